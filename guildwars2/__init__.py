@@ -1,6 +1,8 @@
+import asyncio
 import datetime
 import json
 import logging
+import weakref
 
 import discord
 from PIL import ImageFont
@@ -15,7 +17,7 @@ from .daily import DailyMixin
 from .database import DatabaseMixin
 from .emojis import EmojiMixin
 from .events import EventsMixin, EventTimerReminderUnsubscribeView
-from .evtc import EvtcMixin
+from .evtc import EVTC_MAX_UPLOADS, EVTC_UPLOAD_BUDGET, EvtcMixin
 from .exceptions import APIError, APIInactiveError, APIInvalidKey, APIKeyError
 from .guild import GuildMixin
 from .guild.sync import GuildSyncPromptUserConfirmView
@@ -25,6 +27,13 @@ from .misc import MiscMixin
 from .notifiers import NotiifiersMixin
 from .pvp import PvpMixin
 from .skills import SkillsMixin
+from .utils.accounts import AccountIndex
+from .utils.broadcast import Broadcaster
+from .utils.cache import LRUCache, ResponseCache
+from .utils.ratelimit import (ApiScheduler, DiscordWriteScheduler,
+                              TransferBudget)
+from .utils.static import StaticDataStore
+from .utils.timers import TimerHeap
 from .wallet import WalletMixin
 from .worldsync import WorldsyncMixin
 from .wvw import WvwMixin
@@ -66,7 +75,29 @@ class GuildWars2(
             self.instabilities = json.load(f)
         self.session = bot.session
         self.httpx_client = httpx.AsyncClient()
-        self.boss_schedule = self.generate_schedule()
+        self.api_cache = ResponseCache()
+        self.api_scheduler = ApiScheduler()
+        self.discord_writes = DiscordWriteScheduler()
+        self.evtc_uploads = TransferBudget(EVTC_MAX_UPLOADS, EVTC_UPLOAD_BUDGET)
+        self.evtc_user_slots = weakref.WeakValueDictionary()
+        self.static = StaticDataStore(self.db)
+        self.item_cache = LRUCache()
+        self.encounter_cache = LRUCache(max_bytes=16 * 1024 * 1024)
+        self.home_world_cache = ResponseCache()
+        self.worldsync_topology = None
+        self.worldsync_last_full = 0
+        self.search_indexes = {}
+        self.account_index = AccountIndex(self.db.account_index)
+        self.broadcaster = Broadcaster(self, self.db.broadcasts)
+        self.guildsync_queue = asyncio.PriorityQueue()
+        self.guildsync_entry_number = 0
+        self.guildsync_pending = set()
+        self.guildsync_due = {}
+        self.guildsync_rescan_at = 0
+        self.guildsync_stats = {}
+        self.compile_event_timelines()
+        self.event_reminders = {}
+        self.reminder_timers = TimerHeap()
         self.embed_color = 0xC12D2B
         self.log = logging.getLogger(__name__)
         self.tasks = []
@@ -77,7 +108,16 @@ class GuildWars2(
             self.font = ImageFont.truetype("GWTwoFont1p1.ttf", size=30)
         except IOError:
             self.font = ImageFont.load_default()
-        setup_tasks = [self.prepare_emojis, self.prepare_linkpreview_guild_cache]
+        setup_tasks = [
+            self.prepare_emojis,
+            self.prepare_linkpreview_guild_cache,
+            self.static.load,
+            self.build_search_indexes,
+            self.load_account_index,
+            self.resume_broadcasts,
+            self.load_event_reminders,
+            self.prepare_encounter_cache,
+        ]
         for task in setup_tasks:
             bot.loop.create_task(task())
         self.tasks = [
@@ -86,6 +126,7 @@ class GuildWars2(
             self.gem_tracker,
             self.world_population_checker,
             self.guild_synchronizer,
+            self.guildsync_consumer,
             self.boss_notifier,
             self.forced_account_names,
             self.event_reminder_task,
@@ -12,7 +12,6 @@ from discord.app_commands import Choice
 
 from .exceptions import APIError, APINotFound
 from .utils.chat import embed_list_lines
-from .utils.db import prepare_search
 
 
 class AccountMixin:
@@ -288,11 +287,7 @@ class AccountMixin:
                 })
             return unique_list
 
-        query = prepare_search(current)
-        query = {
-            "name": query,
-        }
-        items = await self.db.items.find(query).to_list(25)
+        items = await self.search_collection("items", current)
         items = sorted(consolidate_duplicates(items), key=lambda c: c["name"])
         return [
             Choice(name=f"{it['name']} - {it['rarity']}", value=it["ids"])
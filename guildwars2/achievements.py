@@ -5,7 +5,6 @@ from discord import app_commands
 
 from .exceptions import APIError, APINotFound
 from .utils.chat import cleanup_xml_tags
-from .utils.db import prepare_search
 
 
 class AchievementsMixin:
@@ -14,11 +13,10 @@ class AchievementsMixin:
                                        current: str):
         if not current:
             return []
-        query = {"name": prepare_search(current)}
-        cursor = self.db.achievements.find(query).limit(25)
+        achievements = await self.search_collection("achievements", current)
         return [
             app_commands.Choice(name=ach["name"], value=str(ach["_id"]))
-            async for ach in cursor
+            for ach in achievements
         ]
 
     @app_commands.command(name="achievement")
@@ -1,4 +1,7 @@
 import asyncio
+import hashlib
+import re
+
 from aiohttp import ContentTypeError
 from tenacity import (
     retry,
@@ -19,9 +22,46 @@ from .exceptions import (
     APIUnavailable,
 )
 import json
+from .utils.accounts import accounts_from_doc
+from .utils.ratelimit import PRIORITY_BACKGROUND, api_priority
+
+API_BASE_URL = "https://api.guildwars2.com/v2/"
+# Maximum number of ids the API accepts in a single ?ids= request
+API_PAGE_SIZE = 200
+
+# Seconds to keep successful responses around, matched against the endpoint
+# in order. Anything not listed is never cached, but identical concurrent
+# requests are still coalesced into one upstream call.
+API_CACHE_TTLS = [
+    (re.compile(r"^commerce/(prices|listings)"), 60),
+    (re.compile(r"^commerce/exchange/"), 120),
+    (re.compile(r"^wvw/matches"), 60),
+    (re.compile(r"^guild/search"), 3600),
+    (re.compile(r"^guild/[^/?]+/(members|ranks)$"), 60),
+    (re.compile(r"^guild/[^/?]+$"), 600),
+    (re.compile(r"^worlds"), 300),
+]
+
+
+def get_cache_ttl(endpoint):
+    for pattern, ttl in API_CACHE_TTLS:
+        if pattern.match(endpoint):
+            return ttl
+    return 0
+
+
+def key_fingerprint(key):
+    if not key:
+        return None
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
 
 
 class ApiMixin:
+    def background_api_calls(self):
+        """Queue API calls made from the current task behind interactive
+        commands. Call at the start of background loops."""
+        api_priority.set(PRIORITY_BACKGROUND)
+
     async def call_multiple(
         self, endpoints, user=None, scopes=None, key=None, **kwargs
     ):
@@ -33,6 +73,40 @@ class ApiMixin:
             tasks.append(self.call_api(e, key=key, **kwargs))
         return await asyncio.gather(*tasks)
 
+    async def call_api_bulk(self,
+                            endpoint,
+                            ids,
+                            *,
+                            user=None,
+                            scopes=None,
+                            key=None,
+                            **kwargs):
+        """Fetch many ids of a bulk endpoint, API_PAGE_SIZE ids per request.
+
+        Pages are requested concurrently. Ids the API doesn't know about are
+        left out, so the returned dict, keyed by id, may be smaller than
+        the input."""
+        if key is None and user:
+            doc = await self.fetch_key(user, scopes)
+            key = doc["key"]
+        ids = list(dict.fromkeys(ids))
+        separator = "&" if "?" in endpoint else "?"
+
+        async def fetch_page(page):
+            ids_string = ",".join(str(i) for i in page)
+            try:
+                return await self.call_api(
+                    f"{endpoint}{separator}ids={ids_string}", key=key, **kwargs)
+            except APINotFound:
+                # None of the ids on this page exist
+                return []
+
+        pages = [
+            ids[i:i + API_PAGE_SIZE] for i in range(0, len(ids), API_PAGE_SIZE)
+        ]
+        results = await asyncio.gather(*[fetch_page(page) for page in pages])
+        return {doc["id"]: doc for page in results for doc in page}
+
     async def cache_result(self, endpoint, result, used_key, user):
         if endpoint == "account" and user:
             doc = await self.bot.database.get(user, self)
@@ -47,6 +121,9 @@ class ApiMixin:
                         if alt_key["account_name"] == old_name:
                             alt_key["account_name"] = new_name
                     await self.bot.database.set(user, {"key": key, "keys": keys}, self)
+                    await self.account_index.update(
+                        user.id, accounts_from_doc({"key": key, "keys": keys})
+                    )
                     await user.send(
                         "Your account name seems to have "
                         "changed! I went ahead and updated it, "
@@ -60,7 +137,7 @@ class ApiMixin:
                     )
 
     @retry(
-        retry=retry_if_exception_type(APIBadRequest),
+        retry=retry_if_exception_type((APIBadRequest, APIRateLimited)),
         reraise=True,
         stop=stop_after_attempt(4),
         wait=wait_chain(wait_fixed(2), wait_fixed(4), wait_fixed(8)),
@@ -86,8 +163,18 @@ class ApiMixin:
             headers.update({"X-Schema-Version": schema})
         if schema_string:
             headers.update({"X-Schema-Version": schema_string})
-        apiserv = "https://api.guildwars2.com/v2/"
-        url = apiserv + endpoint
+        url = API_BASE_URL + endpoint
+        fingerprint = key_fingerprint(key)
+        cache_key = (endpoint, fingerprint, headers.get("X-Schema-Version"))
+        body = await self.api_cache.fetch(
+            cache_key, get_cache_ttl(endpoint),
+            lambda: self.fetch_api(url, headers, fingerprint))
+        data = json.loads(body)
+        asyncio.create_task(self.cache_result(endpoint, data, key, user))
+        return data
+
+    async def fetch_api(self, url, headers, fingerprint=None):
+        await self.api_scheduler.acquire(fingerprint)
         async with self.session.get(url, headers=headers) as r:
             if r.status != 200 and r.status != 206:
                 try:
@@ -109,6 +196,7 @@ class ApiMixin:
                     raise APIInactiveError("API is dead")
                 if r.status == 429:
                     self.log.error("API Call limit saturated")
+                    self.api_scheduler.penalize(10, fingerprint)
                     raise APIRateLimited(
                         "Requests limit has been saturated. Try again later."
                     )
@@ -116,6 +204,5 @@ class ApiMixin:
                     raise APIUnavailable("ArenaNet has disabled the API.")
                 else:
                     raise APIConnectionError("{} {}".format(r.status, err_msg))
-            data = await r.json()
-            asyncio.create_task(self.cache_result(endpoint, data, key, user))
-            return data
+            # Cached as text so every caller decodes its own copy
+            return await r.text()
@@ -18,6 +18,15 @@ from .utils.chat import embed_list_lines, zero_width_space
 LETTERS = ["🇦", "🇧", "🇨", "🇩", "🇪", "🇫", "🇬", "🇭", "🇮", "🇯"]
 
 
+def equipment_item_ids(eq):
+    """Every item id referenced by a list of equipment, upgrades included"""
+    ids = []
+    for piece in eq:
+        ids.append(piece["id"])
+        ids += piece.get("upgrades", []) + piece.get("infusions", [])
+    return ids
+
+
 class CharacterGearDropdown(discord.ui.Select):
 
     def __init__(self, tabs, tab_type, emojis):
@@ -150,8 +159,8 @@ class Character:
                 spec = self.build_tabs[self.active_build_tab -
                                        1]["build"]["specializations"][2]
             if spec:
-                spec = await self.cog.db.specializations.find_one(
-                    {"_id": spec["id"]})
+                spec = await self.cog.static.fetch("specializations",
+                                                   spec["id"])
                 if spec is None or not spec["elite"]:
                     return self.profession.title()
                 return spec["name"]
@@ -248,6 +257,8 @@ class CharactersMixin:
         gear = {piece: {} for piece in pieces}
         profession = await self.get_profession_by_character(results)
         level = results["level"]
+        itemdocs = await self.fetch_items(
+            item["id"] for item in eq if item["slot"] in pieces)
         for item in eq:
             slot = item["slot"]
             if slot not in pieces:
@@ -256,7 +267,7 @@ class CharactersMixin:
             dyes = []
             for dye in dye_ids:
                 if dye:
-                    doc = await self.db.colors.find_one({"_id": dye})
+                    doc = await self.static.fetch("colors", dye)
                     if doc:
                         dyes.append(doc["name"])
                         continue
@@ -268,8 +279,7 @@ class CharactersMixin:
                 if doc:
                     gear[slot]["name"] = doc["name"]
                     continue
-            doc = await self.db.items.find_one({"_id": item["id"]})
-            gear[slot]["name"] = doc["name"]
+            gear[slot]["name"] = itemdocs[item["id"]]["name"]
 
         embed = discord.Embed(description="Fashion", colour=profession.color)
         for piece in pieces:
@@ -427,6 +437,9 @@ class CharactersMixin:
             ]
             weapons = ["WeaponA1", "WeaponA2", "WeaponB1", "WeaponB2"]
             pieces = armors + trinkets + weapons
+            # Warm the item cache so the lookups below don't hit the database
+            # one by one
+            await self.fetch_items(equipment_item_ids(eq))
             for piece in pieces:
                 piece_name = piece
                 if piece[-1].isdigit():
@@ -775,6 +788,7 @@ class CharactersMixin:
         attr_dict = {key: 0 for (key) in attr_list}
         runes = {}
         level = character["level"]
+        await self.fetch_items(equipment_item_ids(eq))
         for piece in eq:
             item = await self.fetch_item(piece["id"])
             # Gear with selectable values
@@ -1161,10 +1175,8 @@ class CharactersMixin:
                 active_tab = tab
                 break
         specs = active_tab["build"]["specializations"]
-        specializations = []
-        for spec in specs:
-            spec_doc = await self.db.specializations.find_one({"_id": spec})
-            specializations.append(spec_doc)
+        spec_docs = await self.static.fetch_many("specializations", specs)
+        specializations = [spec_docs.get(spec) for spec in specs]
         return await self.get_profession(character["profession"],
                                          specializations)
 
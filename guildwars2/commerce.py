@@ -3,9 +3,8 @@ import operator
 import discord
 from discord import app_commands
 from discord.app_commands import Choice
-from cogs.guildwars2.utils.db import prepare_search
 
-from .exceptions import APIBadRequest, APIError, APINotFound
+from .exceptions import APIError, APINotFound
 
 
 class CommerceMixin:
@@ -44,29 +43,22 @@ class CommerceMixin:
                                 "300px-Black-Lion-Logo.png"))
         data.set_footer(text="Black Lion Trading Company")
         results = results[:20]  # Only display 20 most recent transactions
-        item_id = ""
-        dup_item = {}
-        # Collect listed items
-        for result in results:
-            item_id += str(result["item_id"]) + ","
-            if result["item_id"] not in dup_item:
-                dup_item[result["item_id"]] = len(dup_item)
-        # Get information about all items, doesn't matter if string ends with ,
-        endpoint_listing = "commerce/listings?ids={0}".format(str(item_id))
-        # Call API once for all items
-        try:
-            listings = await self.call_api(endpoint_listing)
-        except APIBadRequest:
+        # Get information about all items with as few calls as possible
+        listings = await self.call_api_bulk(
+            "commerce/listings", [result["item_id"] for result in results])
+        if not listings:
             await interaction.followup.send("You don't have any ongoing "
                                             "transactions")
             return None
+        itemdocs = await self.fetch_items(listings)
         for result in results:
-            index = dup_item[result["item_id"]]
+            if result["item_id"] not in listings:
+                continue
             price = result["price"]
-            itemdoc = await self.fetch_item(result["item_id"])
+            itemdoc = itemdocs[result["item_id"]]
             quantity = result["quantity"]
             item_name = itemdoc["name"]
-            offers = listings[index][state]
+            offers = listings[result["item_id"]][state]
             max_price = offers[0]["unit_price"]
             undercuts = 0
             op = operator.lt if state == "buys" else operator.gt
@@ -94,14 +86,15 @@ class CommerceMixin:
                               current: str):
         if not current:
             return []
-        query = prepare_search(current)
-        query = {
-            "name": query,
-            "flags": {
-                "$nin": ["AccountBound", "SoulbindOnAcquire"]
-            }
-        }
-        items = await self.db.items.find(query).to_list(25)
+        untradeable = {"AccountBound", "SoulbindOnAcquire"}
+        items = await self.search_collection(
+            "items",
+            current,
+            predicate=lambda it: not untradeable.intersection(
+                it.get("flags", [])),
+            query={"flags": {
+                "$nin": list(untradeable)
+            }})
         items = sorted(items, key=lambda c: c["name"])
         return [Choice(name=it["name"], value=str(it["_id"])) for it in items]
 
@@ -174,10 +167,10 @@ class CommerceMixin:
         data.add_field(name="Coins", value=gold, inline=False)
         counter = 0
         if len(items) != 0:
+            itemdocs = await self.fetch_items(item["id"] for item in items)
             for item in items:
                 item_quantity.append(item["count"])
-                itemdoc = await self.fetch_item(item["id"])
-                itemlist.append(itemdoc)
+                itemlist.append(itemdocs[item["id"]])
             for item in itemlist:
                 item_name = item["name"]
                 # Get quantity of items
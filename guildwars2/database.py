@@ -1,18 +1,39 @@
 import asyncio
 import collections
 import datetime
+import hashlib
+import json
 import re
 import time
 
 import discord
 from discord.app_commands import Choice
 from discord.ext import commands
-from pymongo import ReplaceOne
+from pymongo import ReplaceOne, UpdateOne
 from pymongo.errors import BulkWriteError
 from discord.ext import tasks
 
+from .api import API_PAGE_SIZE
 from .exceptions import APIError, APIKeyError
 from .utils.db import prepare_search
+from .utils.search import SEARCH_FIELDS, SearchIndex
+
+# Number of already cached documents per endpoint that an incremental
+# rebuild refetches to pick up changes to existing entries
+INCREMENTAL_SAMPLE_SIZE = 2000
+# Upper bound on API pages being fetched or waiting to be handed to a writer
+# at once while caching endpoints. Each endpoint's writer queue can hold as
+# many again.
+CACHE_MAX_INFLIGHT_PAGES = 8
+# Users per $in query when fetching documents in bulk
+USER_DOC_BATCH_SIZE = 1000
+
+
+def content_hash(doc):
+    """Stable digest of a cached document, ignoring the hash field itself"""
+    doc = {k: v for k, v in doc.items() if k != "_hash"}
+    return hashlib.sha1(
+        json.dumps(doc, sort_keys=True, default=str).encode()).hexdigest()
 
 
 class DatabaseMixin:
@@ -31,6 +52,12 @@ class DatabaseMixin:
         """
         await self.rebuild_database()
 
+    @database.command(name="sync")
+    async def db_sync(self, ctx):
+        """Incrementally update the database without going offline"""
+        await self.rebuild_database(incremental=True)
+        await ctx.send("Done")
+
     async def upgrade_legacy_guildsync(self, guild):
         doc = await self.bot.database.get(guild, self)
         sync = doc.get("sync")
@@ -106,6 +133,13 @@ class DatabaseMixin:
             await ctx.send("Encountered error")
         pass
 
+    @database.command(name="reindex_accounts")
+    async def db_reindex_accounts(self, ctx):
+        """Rebuild the account name index from every user's keys"""
+        await self.account_index.load(self.bot.database.users, rebuild=True)
+        await ctx.send("Indexed {} users".format(
+            len(self.account_index.by_user)))
+
     @database.command(name="getwvwdata")
     async def db_getwvwdata(self, ctx, guild: int = None):
         """Get historical wvw population data. Might not work"""
@@ -121,9 +155,62 @@ class DatabaseMixin:
             }}, self)
         await ctx.send("{} registered users".format(result))
 
+    @database.command(name="api")
+    async def db_api_stats(self, ctx):
+        """Outbound API queue and response cache statistics"""
+        lines = ["Scheduler:"]
+        for k, v in self.api_scheduler.stats().items():
+            lines.append(f"  {k}: {v}")
+        lines.append("Response cache:")
+        for k, v in self.api_cache.stats().items():
+            lines.append(f"  {k}: {v}")
+        lines.append("Item cache:")
+        for k, v in self.item_cache.stats().items():
+            lines.append(f"  {k}: {v}")
+        lines.append("Discord writes:")
+        for k, v in self.discord_writes.stats().items():
+            lines.append(f"  {k}: {v}")
+        lines.append("Encounter cache:")
+        for k, v in self.encounter_cache.stats().items():
+            lines.append(f"  {k}: {v}")
+        lines.append("EVTC uploads:")
+        for k, v in self.evtc_uploads.stats().items():
+            lines.append(f"  {k}: {v}")
+        lines.append("Guildsync:")
+        lines.append(f"  queued: {self.guildsync_queue.qsize()}")
+        lines.append(f"  lag: {self.guildsync_stats.get('lag', 0):.1f}s")
+        await ctx.send("```{}```".format("\n".join(lines)))
+
+    async def build_search_indexes(self):
+        for collection, fields in SEARCH_FIELDS.items():
+            projection = {field: 1 for field in ["name"] + fields}
+            docs = await self.db[collection].find({}, projection).to_list(None)
+            # Indexing the items collection takes long enough to stall the
+            # event loop
+            self.search_indexes[collection] = await self.bot.loop.run_in_executor(
+                None, SearchIndex, docs)
+
+    async def search_collection(self,
+                                collection,
+                                current,
+                                *,
+                                limit=25,
+                                predicate=None,
+                                query=None):
+        """Find documents whose name contains current.
+
+        Served from the in-memory index; the Mongo query is only used until
+        the index has been built. predicate and query must express the same
+        filter."""
+        index = self.search_indexes.get(collection)
+        if index is not None:
+            return index.search(current, limit=limit, predicate=predicate)
+        query = {"name": prepare_search(current), **(query or {})}
+        return await self.db[collection].find(query).to_list(limit)
+
     async def get_title(self, title_id):
         try:
-            results = await self.db.titles.find_one({"_id": title_id})
+            results = await self.static.fetch("titles", title_id)
             title = results["name"]
         except (KeyError, TypeError):
             return ""
@@ -131,9 +218,9 @@ class DatabaseMixin:
 
     async def get_world_name(self, wid):
         try:
-            doc = await self.db.worlds.find_one({"_id": wid})
+            doc = await self.static.fetch("worlds", wid)
             name = doc["name"]
-        except KeyError:
+        except (KeyError, TypeError):
             name = None
         return name
 
@@ -149,15 +236,68 @@ class DatabaseMixin:
         return doc["_id"]
 
     async def fetch_statname(self, item):
-        statset = await self.db.itemstats.find_one({"_id": item})
+        statset = await self.static.fetch("itemstats", item)
         try:
             name = statset["name"]
-        except KeyError:
+        except (KeyError, TypeError):
             name = ""
         return name
 
     async def fetch_item(self, item):
-        return await self.db.items.find_one({"_id": item})
+        doc = self.item_cache.get(item)
+        if doc is None:
+            doc = await self.db.items.find_one({"_id": item})
+            if doc is not None:
+                self.item_cache.set(item, doc)
+        return doc
+
+    async def fetch_items(self, ids):
+        """Return {id: doc} for the given item ids, with a single query for
+        whatever isn't cached"""
+        docs = {}
+        missing = set()
+        for item in ids:
+            doc = self.item_cache.get(item)
+            if doc is None:
+                missing.add(item)
+            else:
+                docs[item] = doc
+        if missing:
+            cursor = self.db.items.find({"_id": {"$in": list(missing)}})
+            async for doc in cursor:
+                self.item_cache.set(doc["_id"], doc)
+                docs[doc["_id"]] = doc
+        return docs
+
+    async def get_many(self, users):
+        """Return {user id: cog document} for many users, one query per
+        USER_DOC_BATCH_SIZE users instead of one per user"""
+        docs = {user.id: {} for user in users}
+        ids = list(docs)
+        for i in range(0, len(ids), USER_DOC_BATCH_SIZE):
+            cursor = self.bot.database.users.find(
+                {"_id": {
+                    "$in": ids[i:i + USER_DOC_BATCH_SIZE]
+                }}, {"cogs.GuildWars2": 1})
+            async for doc in cursor:
+                docs[doc["_id"]] = doc.get("cogs", {}).get("GuildWars2", {})
+        return docs
+
+    async def set_many(self, updates):
+        """Apply an iterable of (user, settings) pairs in a single bulk
+        write. Settings for the same user are merged, later ones winning."""
+        merged = collections.defaultdict(dict)
+        for user, settings in updates:
+            merged[user.id].update(settings)
+        requests = []
+        for user_id, settings in merged.items():
+            if not settings:
+                continue
+            update = {f"cogs.GuildWars2.{k}": v for k, v in settings.items()}
+            requests.append(
+                UpdateOne({"_id": user_id}, {"$set": update}, upsert=True))
+        if requests:
+            await self.bot.database.users.bulk_write(requests, ordered=False)
 
     async def fetch_key(self, user, scopes=None):
         doc = await self.bot.database.get_user(user, self)
@@ -229,10 +369,9 @@ class DatabaseMixin:
             self.log.exception("Exception caching dailies: ", exc_info=e)
 
     async def cache_raids(self):
-        raids = []
         raids_index = await self.call_api("raids")
-        for raid in raids_index:
-            raids.append(await self.call_api("raids/" + raid))
+        results = await self.call_api_bulk("raids", raids_index)
+        raids = [results[raid] for raid in raids_index if raid in results]
         await self.bot.database.set_cog_config(self, {"cache.raids": raids})
 
     async def cache_pois(self):
@@ -250,9 +389,11 @@ class DatabaseMixin:
 
         continents = await self.call_api("continents?ids=all")
         pois = []
-        for continent in continents:
-            floors = await self.call_api(
-                f"continents/{continent['id']}/floors?ids=all")
+        all_floors = await self.call_multiple([
+            f"continents/{continent['id']}/floors?ids=all"
+            for continent in continents
+        ])
+        for continent, floors in zip(continents, all_floors):
             for floor in floors:
                 for region in floor["regions"].values():
                     for game_map in region["maps"].values():
@@ -269,49 +410,156 @@ class DatabaseMixin:
         config = await self.bot.database.get_cog_config(self)
         return config["cache"].get("raids")
 
-    async def cache_endpoint(self, endpoint, all_at_once=False):
+    async def get_incremental_ids(self, endpoint, collection, ids):
+        """Pick the ids worth refetching after a game build.
+
+        That's every id not in the database yet, plus a rotating window of
+        already stored ones so changed entries are eventually refreshed."""
+        existing = set(await collection.distinct("_id"))
+        new_ids = [i for i in ids if i not in existing]
+        stored_ids = sorted(i for i in ids if i in existing)
+        if len(stored_ids) <= INCREMENTAL_SAMPLE_SIZE:
+            return new_ids + stored_ids
+        config = await self.bot.database.get_cog_config(self)
+        offsets = config["cache"].get("sync_offsets", {})
+        offset = offsets.get(collection.name, 0) % len(stored_ids)
+        sample = stored_ids[offset:offset + INCREMENTAL_SAMPLE_SIZE]
+        sample += stored_ids[:INCREMENTAL_SAMPLE_SIZE - len(sample)]
+        await self.bot.database.set_cog_config(
+            self, {
+                f"cache.sync_offsets.{collection.name}":
+                offset + INCREMENTAL_SAMPLE_SIZE
+            })
+        print("{}: {} new, {} sampled".format(endpoint, len(new_ids),
+                                              len(sample)))
+        return new_ids + sample
+
+    async def cache_endpoint(self,
+                             endpoint,
+                             all_at_once=False,
+                             *,
+                             incremental=False,
+                             semaphore=None):
+        collection = self.db[endpoint.replace("/", "_")]
+
+        counts = collections.Counter()
 
         async def bulk_write(item_group):
-            requests = []
-            for item in itemgroup:
+            for item in item_group:
                 item["_id"] = item.pop("id")
-                requests.append(
-                    ReplaceOne({"_id": item["_id"]}, item, upsert=True))
+                item["_hash"] = content_hash(item)
+            ids = [item["_id"] for item in item_group]
+            cursor = collection.find({"_id": {"$in": ids}}, {"_hash": 1})
+            current = {doc["_id"]: doc.get("_hash") async for doc in cursor}
+            requests = [
+                ReplaceOne({"_id": item["_id"]}, item, upsert=True)
+                for item in item_group
+                if current.get(item["_id"]) != item["_hash"]
+            ]
+            counts["untouched"] += len(item_group) - len(requests)
+            if not requests:
+                return
             try:
-                await self.db[endpoint.replace("/", "_")].bulk_write(requests)
+                result = await collection.bulk_write(requests, ordered=False)
+                counts["inserted"] += result.upserted_count
+                counts["updated"] += result.modified_count
             except BulkWriteError as e:
+                counts["inserted"] += e.details.get("nUpserted", 0)
+                counts["updated"] += e.details.get("nModified", 0)
+                counts["failed"] += len(e.details.get("writeErrors", []))
                 self.log.exception("BWE while caching {}".format(endpoint),
                                    exc_info=e)
 
-        items = await self.call_api(endpoint,
-                                    schema_string="2021-07-15T13:00:00.000Z")
-        if not all_at_once:
-            counter = 0
-            total = len(items)
-            while True:
-                percentage = (counter / total) * 100
-                print("Progress: {0:.1f}%".format(percentage))
-                ids = ",".join(str(x) for x in items[counter:counter + 200])
-                if not ids:
-                    print("{} done".format(endpoint))
-                    break
+        def report():
+            print("{}: {} inserted, {} updated, {} untouched, {} failed".format(
+                endpoint, counts["inserted"], counts["updated"],
+                counts["untouched"], counts["failed"]))
+
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(CACHE_MAX_INFLIGHT_PAGES)
+        start = time.time()
+        if all_at_once:
+            async with semaphore:
                 itemgroup = await self.call_api(
-                    f"{endpoint}?ids={ids}",
+                    "{}?ids=all".format(endpoint),
                     schema_string="2021-07-15T13:00:00.000Z")
-                await bulk_write(itemgroup)
-                counter += 200
-        else:
-            itemgroup = await self.call_api(
-                "{}?ids=all".format(endpoint),
-                schema_string="2021-07-15T13:00:00.000Z")
             await bulk_write(itemgroup)
+            print("{}: {} docs in {:.1f}s".format(endpoint, len(itemgroup),
+                                                  time.time() - start))
+            report()
+            return counts
+        async with semaphore:
+            items = await self.call_api(
+                endpoint, schema_string="2021-07-15T13:00:00.000Z")
+        if incremental:
+            items = await self.get_incremental_ids(endpoint, collection, items)
+        pages = [
+            items[i:i + API_PAGE_SIZE]
+            for i in range(0, len(items), API_PAGE_SIZE)
+        ]
+        # Pages are fetched concurrently and handed over to a single writer,
+        # so Mongo writes overlap with the requests still in flight
+        queue = asyncio.Queue(maxsize=CACHE_MAX_INFLIGHT_PAGES)
+        written = {"pages": 0, "docs": 0}
+
+        async def fetch_page(page):
+            ids = ",".join(str(x) for x in page)
+            # The slot is held until the writer takes the page, so a slow
+            # writer stops new fetches instead of piling up pages
+            async with semaphore:
+                itemgroup = await self.call_api(
+                    f"{endpoint}?ids={ids}",
+                    schema_string="2021-07-15T13:00:00.000Z")
+                await queue.put(itemgroup)
 
-    async def rebuild_database(self):
+        async def writer():
+            report_every = max(len(pages) // 10, 1)
+            while True:
+                itemgroup = await queue.get()
+                if itemgroup is None:
+                    return
+                await bulk_write(itemgroup)
+                written["pages"] += 1
+                written["docs"] += len(itemgroup)
+                if not written["pages"] % report_every:
+                    elapsed = time.time() - start
+                    print("{}: {:.1f}% ({:.0f} docs/s)".format(
+                        endpoint, written["pages"] / len(pages) * 100,
+                        written["docs"] / elapsed))
+
+        async def produce():
+            await asyncio.gather(*fetchers)
+            await queue.put(None)
+
+        fetchers = [asyncio.create_task(fetch_page(page)) for page in pages]
+        writer_task = asyncio.create_task(writer())
+        try:
+            await asyncio.gather(produce(), writer_task)
+        finally:
+            for task in fetchers + [writer_task]:
+                task.cancel()
+        elapsed = time.time() - start
+        print("{}: {} pages, {} docs in {:.1f}s ({:.0f} docs/s)".format(
+            endpoint, written["pages"], written["docs"], elapsed,
+            written["docs"] / elapsed if elapsed else 0))
+        report()
+        return counts
+
+    async def rebuild_database(self,
+                               *,
+                               incremental=False,
+                               concurrency=CACHE_MAX_INFLIGHT_PAGES):
+        """Refresh the cached game data.
+
+        A full rebuild re-downloads everything and takes the bot offline
+        while it runs. An incremental one only fetches what's likely to have
+        changed and keeps the bot available."""
         start = time.time()
-        self.bot.available = False
-        await self.bot.change_presence(
-            activity=discord.Game(name="Rebuilding API cache"),
-            status=discord.Status.dnd)
+        if not incremental:
+            self.bot.available = False
+            await self.bot.change_presence(
+                activity=discord.Game(name="Rebuilding API cache"),
+                status=discord.Status.dnd)
         endpoints = [["items"], ["achievements"], ["itemstats", True],
                      ["titles", True], ["recipes"], ["skins"],
                      ["currencies", True], ["skills", True],
@@ -319,14 +567,20 @@ class DatabaseMixin:
                      ["worlds", True], ["minis", True], ["pvp/amulets", True],
                      ["professions", True], ["legends", True], ["pets", True],
                      ["outfits", True], ["colors", True]]
-        for e in endpoints:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def cache(e):
             try:
-                await self.cache_endpoint(*e)
-            except:
+                await self.cache_endpoint(*e,
+                                          incremental=incremental,
+                                          semaphore=semaphore)
+            except Exception:
                 msg = "Caching {} failed".format(e)
                 self.log.warn(msg)
                 owner = self.bot.get_user(self.bot.owner_id)
                 await owner.send(msg)
+
+        await asyncio.gather(*[cache(e) for e in endpoints])
         await self.db.items.create_index("name")
         await self.db.achievements.create_index("name")
         await self.db.titles.create_index("name")
@@ -337,9 +591,13 @@ class DatabaseMixin:
         await self.db.worlds.create_index("name")
         await self.cache_raids()
         await self.cache_pois()
+        await self.static.load()
+        self.item_cache.clear()
+        await self.build_search_indexes()
         end = time.time()
-        await self.bot.change_presence()
-        self.bot.available = True
+        if not incremental:
+            await self.bot.change_presence()
+            self.bot.available = True
         print("Done")
         self.log.info("Database done! Time elapsed: {} seconds".format(end -
                                                                        start))
@@ -364,11 +622,7 @@ class DatabaseMixin:
                 })
             return unique_list
 
-        query = prepare_search(current)
-        query = {
-            "name": query,
-        }
-        items = await self.db.items.find(query).to_list(25)
+        items = await self.search_collection("items", current)
         items = sorted(consolidate_duplicates(current),
                        key=lambda c: c["name"])
         return [
@@ -423,6 +677,7 @@ class DatabaseMixin:
     @tasks.loop(
         time=[datetime.time(hour=1, minute=1, tzinfo=datetime.timezone.utc)])
     async def cache_dailies_tomorrow(self):
+        self.background_api_calls()
         await self.cache_dailies(tomorrow=True, real_tomorrow=True)
 
     @cache_dailies_tomorrow.error
@@ -1,13 +1,24 @@
 import asyncio
+import collections
 import datetime
+import time
 
 import discord
 from discord import app_commands
 from discord.app_commands import Choice
 from discord.ext import tasks
 
+from .utils.timeline import Timeline
+
 UTC_TZ = datetime.timezone.utc
 
+DAY = 86400
+# Map meta events repeat every two hours
+PHASE_CYCLE = 7200
+
+# Reminders go out this many seconds ahead of the time the user asked for
+REMINDER_LEEWAY = 30
+
 ET_CATEGORIES = [{
     "value": "hot",
     "name": "HoT - Heart of Thorns"
@@ -32,6 +43,15 @@ ET_CATEGORIES = [{
 }]
 
 
+def reminded_recently(reminder):
+    """Whether the reminder already went out for the upcoming occurrence"""
+    last_reminded = reminder.get("last_reminded")
+    if not last_reminded:
+        return False
+    elapsed = (datetime.datetime.utcnow() - last_reminded).total_seconds()
+    return elapsed < reminder["time"] + 120
+
+
 class EventTimerReminderUnsubscribeView(discord.ui.View):
 
     def __init__(self, cog):
@@ -53,6 +73,7 @@ class EventTimerReminderUnsubscribeView(discord.ui.View):
             operator="pull",
         )
         if update_result.modified_count:
+            await self.cog.reload_event_reminders(interaction.user.id)
             try:
                 await interaction.message.delete()
             except discord.HTTPException:
@@ -158,66 +179,63 @@ class EventsMixin:
         for message in to_cleanup:
             asyncio.create_task(message.delete())
 
-    def generate_schedule(self):
-        now = datetime.datetime.now(UTC_TZ)
-        normal = self.gamedata["event_timers"]["bosses"]["normal"]
-        hardcore = self.gamedata["event_timers"]["bosses"]["hardcore"]
-        schedule = []
-        counter = 0
-        while counter < 12:
-            for boss in normal:
-                increment = datetime.timedelta(hours=boss["interval"] *
-                                               counter)
-                time = (datetime.datetime(
-                    1, 1, 1, *boss["start_time"], tzinfo=UTC_TZ) + increment)
-                if time.day != 1:
-                    continue
-                time = time.replace(year=now.year,
-                                    month=now.month,
-                                    day=now.day,
-                                    tzinfo=UTC_TZ)
-                output = {
-                    "name": boss["name"],
-                    "time": time,
-                    "waypoint": boss["waypoint"],
-                }
-                schedule.append(output)
-            counter += 1
-        for boss in hardcore:
-            for hours in boss["times"]:
-                time = datetime.datetime.now(UTC_TZ)
-                time = time.replace(hour=hours[0], minute=hours[1])
-                output = {
-                    "name": boss["name"],
-                    "time": time,
-                    "waypoint": boss["waypoint"],
-                }
-                schedule.append(output)
-        return sorted(schedule, key=lambda t: t["time"].time())
+    def compile_event_timelines(self):
+        """Build the timelines every event timer lookup is answered from"""
+        timers = self.gamedata["event_timers"]
+        bosses = []
+        for boss in timers["bosses"]["normal"]:
+            start = 3600 * boss["start_time"][0] + 60 * boss["start_time"][1]
+            for offset in range(start, DAY, 3600 * boss["interval"]):
+                bosses.append((offset, boss))
+        for boss in timers["bosses"]["hardcore"]:
+            for hour, minute in boss["times"]:
+                bosses.append((3600 * hour + 60 * minute, boss))
+        bosses = [(offset, {
+            "name": boss["name"],
+            "waypoint": boss["waypoint"]
+        }) for offset, boss in bosses]
+        self.boss_timeline = Timeline(DAY, bosses)
+        by_name = collections.defaultdict(list)
+        for offset, boss in bosses:
+            by_name[("boss", boss["name"])].append((offset, boss))
+        self.phase_timelines = {}
+        self.event_timelines = {}
+        for group, maps in timers.items():
+            if group == "bosses":
+                continue
+            for location in maps:
+                phases = []
+                offset = 0
+                for phase in location["phases"]:
+                    phases.append((offset, phase))
+                    offset += phase["duration"] * 60
+                key = group, location["name"]
+                self.phase_timelines[key] = Timeline(PHASE_CYCLE, phases)
+                starts = []
+                for i, (offset, phase) in enumerate(phases):
+                    name = phase["name"]
+                    # A phase carrying on from one with the same name, even
+                    # across the end of the cycle, isn't a new start
+                    if name and name != phases[i - 1][1]["name"]:
+                        starts.append((offset, name))
+                        by_name[("phase", *key, name)].append((offset, name))
+                self.event_timelines[key] = Timeline(PHASE_CYCLE, starts)
+        self.reminder_timelines = {
+            k: Timeline(PHASE_CYCLE if k[0] == "phase" else DAY, v)
+            for k, v in by_name.items()
+        }
 
     def get_upcoming_bosses(self, limit=8):
         upcoming_bosses = []
         time = datetime.datetime.now(UTC_TZ)
-        counter = 0
-        day = 0
-        done = False
-        while not done:
-            for boss in self.boss_schedule:
-                if counter == limit:
-                    done = True
-                    break
-                boss_time = boss["time"]
-                boss_time = boss_time + datetime.timedelta(days=day)
-                if time < boss_time:
-                    output = {
-                        "name": boss["name"],
-                        "time": f"<t:{int(boss_time.timestamp())}:t>",
-                        "waypoint": boss["waypoint"],
-                        "diff": boss_time - time,
-                    }
-                    upcoming_bosses.append(output)
-                    counter += 1
-            day += 1
+        for boss_time, boss in self.boss_timeline.occurrences(time, limit):
+            output = {
+                "name": boss["name"],
+                "time": f"<t:{int(boss_time.timestamp())}:t>",
+                "waypoint": boss["waypoint"],
+                "diff": boss_time - time,
+            }
+            upcoming_bosses.append(output)
         return upcoming_bosses
 
     def schedule_embed(self, limit=8):
@@ -249,9 +267,6 @@ class EventsMixin:
 
     async def timer_embed(self, ctx, group):
         time = datetime.datetime.now(datetime.timezone.utc)
-        position = (
-            60 * time.hour + time.minute
-        ) % 120  # this gets the minutes elapsed in the current 2 hour window
         maps = self.gamedata["event_timers"][group]
         title = {
             "hot": "HoT Event Timer",
@@ -263,36 +278,20 @@ class EventsMixin:
         embed = discord.Embed(title=title,
                               color=await self.get_embed_color(ctx))
         for location in maps:
-            duration_so_far = 0
-            current_phase = None
-            index = 0
-            phases = location["phases"]
-            # TODO null handling
-            for i, phase in enumerate(phases):
-                if position < duration_so_far:
-                    break
-                current_phase = phase["name"]
-                index = i
-                duration_so_far += phase["duration"]
-            double = phases + phases
-            for phase in double[index + 1:]:
-                if not phase["name"]:
-                    duration_so_far += phase["duration"]
-                    continue
-                if phase["name"] == current_phase:
-                    duration_so_far += phase["duration"]
-                    continue
-                break
-            next_phase = phase["name"]
-            time_until = duration_so_far - position
-            event_time = time + datetime.timedelta(minutes=time_until)
-            timestamp = f"<t:{int(event_time.timestamp())}:R>"
+            key = group, location["name"]
+            current = self.phase_timelines[key].current(time)
+            current_phase = current[1]["name"] if current else None
+            upcoming = self.event_timelines[key].next(
+                time, lambda name: name != current_phase)
             if current_phase:
                 current = f"Current phase: **{current_phase}**"
             else:
                 current = "No events currently active."
-            value = (current +
-                     "\nNext phase: **{}** {}".format(next_phase, timestamp))
+            value = current
+            if upcoming:
+                event_time, next_phase = upcoming
+                timestamp = f"<t:{int(event_time.timestamp())}:R>"
+                value += "\nNext phase: **{}** {}".format(next_phase, timestamp)
             embed.add_field(name=location["name"], value=value, inline=False)
         embed.set_footer(text=self.bot.user.name,
                          icon_url=self.bot.user.display_avatar.url)
@@ -311,59 +310,26 @@ class EventsMixin:
         return tz or UTC_TZ
 
     def get_time_until_event(self, reminder):
+        """Seconds until the reminder's event next starts, or None if it is
+        no longer on the timers"""
         if reminder["type"] == "boss":
-            time = datetime.datetime.now(UTC_TZ)
-            day = 0
-            done = False
-            while not done:
-                for boss in self.boss_schedule:
-                    boss_time = boss["time"]
-                    boss_time = boss_time + datetime.timedelta(days=day)
-                    if time < boss_time:
-                        if boss["name"] == reminder["name"]:
-                            return int((
-                                boss_time -
-                                datetime.datetime.now(UTC_TZ)).total_seconds())
-                day += 1
-        time = datetime.datetime.utcnow()
-        position = (60 * time.hour + time.minute) % 120
-        for location in self.gamedata["event_timers"][reminder["group"]]:
-            if location["name"] == reminder["map_name"]:
-                duration_so_far = 0
-                index = 0
-                phases = location["phases"]
-                for i, phase in enumerate(phases):
-                    if position < duration_so_far:
-                        break
-                    index = i
-                    duration_so_far += phase["duration"]
-                index += 1
-                if index == len(phases):
-                    if phases[0]["name"] == phases[index - 1]["name"]:
-                        index = 1
-                        duration_so_far += phases[0]["duration"]
-                    else:
-                        index = 0
-                for phase in phases[index:]:
-                    if phase["name"] == reminder["name"]:
-                        break
-                    duration_so_far += phase["duration"]
-                else:
-                    for phase in phases:
-                        if phase["name"] == reminder["name"]:
-                            break
-                        duration_so_far += phase["duration"]
-                return (duration_so_far - position) * 60
+            key = "boss", reminder["name"]
+        else:
+            key = ("phase", reminder["group"], reminder["map_name"],
+                   reminder["name"])
+        timeline = self.reminder_timelines.get(key)
+        if not timeline:
+            return None
+        now = datetime.datetime.now(UTC_TZ)
+        when, _ = timeline.next(now)
+        return int((when - now).total_seconds())
 
     # TODO
-    async def process_reminder(self, user, reminder, i):
+    async def process_reminder(self, user, reminder, i, updates):
         time = self.get_time_until_event(reminder)
 
-        if time < reminder["time"] + 30:
-            last_reminded = reminder.get("last_reminded")
-            if (last_reminded and
-                (datetime.datetime.utcnow() - last_reminded).total_seconds()
-                    < reminder["time"] + 120):
+        if time <= reminder["time"] + REMINDER_LEEWAY:
+            if reminded_recently(reminder):
                 return
             try:
                 last_message = reminder.get("last_message")
@@ -386,31 +352,89 @@ class EventsMixin:
                     embed=embed, view=EventTimerReminderUnsubscribeView(self))
             except discord.HTTPException:
                 return
-            reminder["last_reminded"] = msg.created_at
+            # Naive UTC, like the value read back from the database
+            reminder["last_reminded"] = msg.created_at.replace(tzinfo=None)
             reminder["last_message"] = msg.id
-            await self.bot.database.set(user,
-                                        {f"event_reminders.{i}": reminder},
-                                        self)
+            updates.append((user, {f"event_reminders.{i}": reminder}))
 
-    @tasks.loop(seconds=10)
-    async def event_reminder_task(self):
-        cursor = self.bot.database.iter(
-            "users", {"event_reminders": {
+    def schedule_event_reminder(self, user_id, i, *, fired=False):
+        reminder = self.event_reminders[user_id][i]
+        until = self.get_time_until_event(reminder)
+        if until is None:
+            self.reminder_timers.cancel((user_id, i))
+            return
+        if until > reminder["time"] + REMINDER_LEEWAY:
+            delay = until - reminder["time"] - REMINDER_LEEWAY
+        elif not fired and not reminded_recently(reminder):
+            # Already inside the lead time, e.g. just subscribed
+            delay = 0
+        else:
+            # Already reminded for this one, look again once it has started
+            delay = max(until, 0) + 60
+        self.reminder_timers.schedule((user_id, i), time.time() + delay)
+
+    def set_event_reminders(self, user_id, reminders):
+        for i in range(len(self.event_reminders.pop(user_id, []))):
+            self.reminder_timers.cancel((user_id, i))
+        if not reminders:
+            return
+        self.event_reminders[user_id] = reminders
+        for i in range(len(reminders)):
+            self.schedule_event_reminder(user_id, i)
+
+    async def load_event_reminders(self):
+        self.event_reminders.clear()
+        cursor = self.bot.database.users.find(
+            {"cogs.GuildWars2.event_reminders": {
                 "$exists": True,
                 "$ne": []
-            }}, self)
+            }}, {"cogs.GuildWars2.event_reminders": 1})
         async for doc in cursor:
+            self.set_event_reminders(
+                doc["_id"], doc["cogs"]["GuildWars2"]["event_reminders"])
+
+    async def reload_event_reminders(self, user_id):
+        doc = await self.bot.database.users.find_one(
+            {"_id": user_id}, {"cogs.GuildWars2.event_reminders": 1})
+        reminders = []
+        if doc:
+            reminders = doc.get("cogs", {}).get("GuildWars2", {}).get(
+                "event_reminders", [])
+        self.set_event_reminders(user_id, reminders)
+
+    async def fire_event_reminder(self, user_id, i, updates):
+        reminders = self.event_reminders.get(user_id)
+        if not reminders or i >= len(reminders):
+            return
+        try:
+            user = self.bot.get_user(user_id)
+            if user:
+                await self.process_reminder(user, reminders[i], i, updates)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.log.exception("Error while sending event reminder",
+                               exc_info=e)
+        finally:
+            if self.event_reminders.get(user_id) is reminders:
+                self.schedule_event_reminder(user_id, i, fired=True)
+
+    @tasks.loop()
+    async def event_reminder_task(self):
+        due = await self.reminder_timers.wait()
+        # Reminders tend to come due together, so their bookkeeping is
+        # written back in one go
+        updates = []
+        await asyncio.gather(*[
+            self.fire_event_reminder(user_id, i, updates)
+            for user_id, i in due
+        ])
+        if updates:
             try:
-                user = doc["_obj"]
-                if not user:
-                    continue
-                for i, reminder in enumerate(doc["event_reminders"]):
-                    asyncio.create_task(
-                        self.process_reminder(user, reminder, i))
-            except asyncio.CancelledError:
-                return
-            except Exception:
-                pass
+                await self.set_many(updates)
+            except Exception as e:
+                self.log.exception("Error while saving event reminders",
+                                   exc_info=e)
 
     @event_reminder_task.before_loop
     async def before_event_reminder_task(self):
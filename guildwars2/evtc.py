@@ -19,6 +19,72 @@ UPLOAD_URL = BASE_URL + "uploadContent"
 JSON_URL = BASE_URL + "getJson"
 TOKEN_URL = BASE_URL + "getUserToken"
 ALLOWED_FORMATS = (".evtc", ".zevtc", ".zip")
+# Logs are streamed from Discord to dps.report in chunks of this size
+UPLOAD_CHUNK_SIZE = 64 * 1024
+EVTC_MAX_UPLOADS = 6
+EVTC_UPLOAD_BUDGET = 64 * 1024 * 1024
+EVTC_USER_CONCURRENCY = 3
+# Compacted encounter JSON is kept this long in the database
+ENCOUNTER_DATA_TTL = 30 * 86400
+SOUGHT_BUFFS = ["Might", "Fury", "Quickness", "Alacrity", "Protection"]
+
+
+def compact_encounter_data(data):
+    """Strip a dps.report getJson document down to what upload_embed and
+    the autopost filters read"""
+    buff_map = {
+        key: {
+            "name": value["name"],
+            "stacking": value["stacking"]
+        }
+        for key, value in data["buffMap"].items()
+        if value["name"] in SOUGHT_BUFFS
+    }
+    buff_ids = {int(key[1:]) for key in buff_map}
+    players = []
+    for player in data["players"]:
+        compact = {
+            "name": player["name"],
+            "account": player["account"],
+            "profession": player["profession"],
+            "group": player["group"],
+            "guildID": player.get("guildID"),
+            "defenses": [{
+                "downCount": player["defenses"][0]["downCount"]
+            }],
+            "dpsTargets": [[{
+                "dps": target[0]["dps"]
+            }] for target in player["dpsTargets"]],
+        }
+        if "buffUptimes" in player:
+            compact["buffUptimes"] = []
+            for uptime in player["buffUptimes"]:
+                if uptime["id"] in buff_ids:
+                    compact["buffUptimes"].append({
+                        "id": uptime["id"],
+                        "buffData": [{
+                            "uptime": uptime["buffData"][0]["uptime"]
+                        }]
+                    })
+        players.append(compact)
+    return {
+        "triggerID": data["triggerID"],
+        "fightName": data["fightName"],
+        "recordedBy": data.get("recordedBy"),
+        "timeStart": data["timeStart"],
+        "timeEnd": data["timeEnd"],
+        "duration": data["duration"],
+        "success": data["success"],
+        "phases": [{
+            "targets": data["phases"][0]["targets"]
+        }],
+        "targets": [{
+            "name": target["name"],
+            "healthPercentBurned": target["healthPercentBurned"]
+        } for target in data["targets"]],
+        "buffMap": buff_map,
+        "players": players,
+    }
 
 
 class EvtcGuildSelectionViewSelect(discord.ui.Select):
@@ -141,15 +207,22 @@ class EvtcMixin:
         token = await self.get_dpsreport_usertoken(user)
         if token:
             params["userToken"] = token
-        data = aiohttp.FormData()
-        data.add_field("file", await file.read(), filename=file.filename)
-        async with self.session.post(UPLOAD_URL, data=data,
-                                     params=params) as r:
-            resp = await r.json()
-            error = resp["error"]
-            if error:
-                raise APIError(error)
-            return resp
+        async with self.evtc_uploads.acquire(file.size):
+            async with self.session.get(file.url) as source:
+                source.raise_for_status()
+                data = aiohttp.FormData()
+                data.add_field(
+                    "file",
+                    source.content.iter_chunked(UPLOAD_CHUNK_SIZE),
+                    filename=file.filename)
+                async with self.session.post(UPLOAD_URL,
+                                             data=data,
+                                             params=params) as r:
+                    resp = await r.json()
+        error = resp["error"]
+        if error:
+            raise APIError(error)
+        return resp
 
     async def find_duplicate_dps_report(self, doc):
         margin_of_error = datetime.timedelta(seconds=10)
@@ -169,10 +242,32 @@ class EvtcMixin:
         })
         return True if doc else False
 
+    async def prepare_encounter_cache(self):
+        await self.db.evtc.encounter_data.create_index(
+            "cached_at", expireAfterSeconds=ENCOUNTER_DATA_TTL)
+
     async def get_encounter_data(self, encounter_id):
-        async with self.session.get(JSON_URL, params={"id":
-                                                      encounter_id}) as r:
-            return await r.json()
+        data = self.encounter_cache.get(encounter_id)
+        if data is not None:
+            return data
+        doc = await self.db.evtc.encounter_data.find_one({"_id": encounter_id})
+        if doc:
+            data = doc["data"]
+        else:
+            async with self.session.get(JSON_URL,
+                                        params={"id": encounter_id}) as r:
+                data = await r.json()
+            if data.get("error") or "players" not in data:
+                return data
+            data = compact_encounter_data(data)
+            await self.db.evtc.encounter_data.replace_one(
+                {"_id": encounter_id}, {
+                    "data": data,
+                    "cached_at": datetime.datetime.utcnow()
+                },
+                upsert=True)
+        self.encounter_cache.set(encounter_id, data)
+        return data
 
     async def upload_embed(self, destination, data, permalink):
         force_emoji = True if not destination else False
@@ -260,9 +355,8 @@ class EvtcMixin:
         if not wvw:
             embed.add_field(name="> **BOSS**", value="\n".join(boss_lines))
         buff_lines = []
-        sought_buffs = ["Might", "Fury", "Quickness", "Alacrity", "Protection"]
         buffs = []
-        for buff in sought_buffs:
+        for buff in SOUGHT_BUFFS:
             for key, value in data["buffMap"].items():
                 if value["name"] == buff:
                     buffs.append({
@@ -276,7 +370,7 @@ class EvtcMixin:
         icon_line = line
         blank = self.get_emoji(destination, "blank", force_emoji=True)
         first = True
-        for buff in sought_buffs:
+        for buff in SOUGHT_BUFFS:
             if first and not blank:
                 icon_line = icon_line[:-2]
             if not first:
@@ -562,24 +656,41 @@ class EvtcMixin:
                            user,
                            destination,
                            anonymous=False):
-        embeds = []
-        for attachment in files:
-            if attachment.filename.endswith(ALLOWED_FORMATS):
+        logs = [f for f in files if f.filename.endswith(ALLOWED_FORMATS)]
+        # Shared by everything this user has in flight, and dropped once
+        # they have nothing left
+        slots = self.evtc_user_slots.get(user.id)
+        if slots is None:
+            slots = asyncio.Semaphore(EVTC_USER_CONCURRENCY)
+            self.evtc_user_slots[user.id] = slots
+
+        async def process(attachment):
+            async with slots:
+                resp = await self.upload_log(attachment,
+                                             user,
+                                             anonymous=anonymous)
+                data = await self.get_encounter_data(resp["id"])
+                return await self.upload_embed(destination, data,
+                                               resp["permalink"])
+
+        tasks = [asyncio.ensure_future(process(log)) for log in logs]
+        try:
+            # Post in attachment order, each as soon as it and everything
+            # before it is done
+            for attachment, task in zip(logs, tasks):
                 try:
-                    resp = await self.upload_log(attachment,
-                                                 user,
-                                                 anonymous=anonymous)
-                    data = await self.get_encounter_data(resp["id"])
-                    embeds.append(await
-                                  self.upload_embed(destination, data,
-                                                    resp["permalink"]))
+                    embed = await task
                 except Exception as e:
                     self.log.exception("Exception processing EVTC log ",
                                        exc_info=e)
-                    return await destination.send(
-                        content="Error processing your log! :x:")
-        for embed in embeds:
-            await destination.send(embed=embed)
+                    name = discord.utils.escape_markdown(attachment.filename)
+                    await destination.send(
+                        content=f"Error processing {name}! :x:")
+                    continue
+                await destination.send(embed=embed)
+        finally:
+            for task in tasks:
+                task.cancel()
 
     @tasks.loop(seconds=5)
     async def post_evtc_notifications(self):
@@ -1,6 +1,7 @@
 from __future__ import annotations
 import asyncio
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
 
 import discord
 from discord import app_commands
@@ -14,6 +15,22 @@ from ..exceptions import (APIError, APIForbidden, APIInvalidKey, APIKeyError,
 
 PROMPT_EMOJIS = ["✅", "❌"]
 GUILDSYNC_LIMIT = 8
+# Between full reconciliations a guildsync only looks at accounts whose
+# roster entry changed since the previous run
+GUILDSYNC_FULL_INTERVAL = timedelta(hours=6)
+# Guilds synced concurrently by the guildsync workers
+GUILDSYNC_WORKERS = 4
+# Seconds between two periodic syncs of the same guild. Guilds that take
+# longer than half of that to sync wait twice their run time instead, so a
+# few huge guilds can't monopolise the workers.
+GUILDSYNC_INTERVAL = 60
+GUILDSYNC_TIMEOUT = 200
+# Seconds between rereads of which guilds have guildsync enabled. Toggling
+# it takes effect immediately regardless.
+GUILDSYNC_RESCAN_INTERVAL = 600
+# Queue priority of syncs triggered for a single member, ahead of any
+# periodic sync
+GUILDSYNC_PRIORITY_MEMBER = 0
 
 # GUILDSYNC SCHEMA
 #        guild_info = {
@@ -25,6 +42,8 @@ GUILDSYNC_LIMIT = 8
 #            "tag_role": int - role id of the tag role
 #            "guild_id" : int - discord guild id
 #            "key" : api key
+#            "roster": list - [account name, rank] pairs from the last run
+#            "last_full_sync": datetime - last full reconciliation
 #        }
 
 
@@ -164,6 +183,10 @@ class GuildSync:
             self.base_ep = f"guild/{self.id}/"
             self.ranks = None
             self.members = None
+            roster = doc.get("roster")
+            self.previous_members = dict(roster) if roster is not None else None
+            self.last_full_sync = doc.get("last_full_sync")
+            self.roles_changed = False
             self.error = None
             self.last_error = doc.get("error")
             self.create_roles = guild.me.guild_permissions.manage_roles
@@ -174,12 +197,31 @@ class GuildSync:
             results = await self.cog.call_api(endpoint=ep, key=self.key)
             self.members = {r["name"]: r["rank"] for r in results}
 
+        def needs_full_sync(self):
+            if self.previous_members is None or self.roles_changed:
+                return True
+            if not self.last_full_sync:
+                return True
+            elapsed = datetime.utcnow() - self.last_full_sync
+            return elapsed > GUILDSYNC_FULL_INTERVAL
+
+        def changed_accounts(self):
+            """Accounts that joined, left or changed rank since the last run"""
+            previous = self.previous_members or {}
+            return {
+                account
+                for account in previous.keys() | self.members.keys()
+                if previous.get(account) != self.members.get(account)
+            }
+
         async def save(self,
                        *,
                        ranks=False,
                        tag_role=False,
                        edited=False,
-                       error=False):
+                       error=False,
+                       roster=False,
+                       full_sync=False):
             update = {}
             if ranks:
                 roles = {rank: role.id for rank, role in self.roles.items()}
@@ -190,8 +232,14 @@ class GuildSync:
                 update["key"] = self.key
                 update["enabled.ranks"] = self.ranks_enabled
                 update["enabled.tag"] = self.tag_enabled
+                # Settings changed, so the next run has to look at everyone
+                update["roster"] = None
             if error:
                 update["error"] = self.error
+            if roster:
+                update["roster"] = [[k, v] for k, v in self.members.items()]
+            if full_sync:
+                update["last_full_sync"] = datetime.utcnow()
             await self.cog.db.guildsyncs.update_one({"_id": self.doc_id},
                                                     {"$set": update})
 
@@ -246,6 +294,7 @@ class GuildSync:
                     if role:
                         self.tag_role = role
                         self.tag_role_id = role.id
+                        self.roles_changed = True
                         await self.save(tag_role=True)
             else:
                 if self.tag_role_id:
@@ -290,6 +339,7 @@ class GuildSync:
                     for k, r in self.roles.items()
                 }
                 if changed:
+                    self.roles_changed = True
                     await self.save(ranks=True)
 
             else:
@@ -303,10 +353,14 @@ class GuildSync:
     class SyncTarget:
 
         @classmethod
-        async def create(cls, cog, member) -> GuildSync.SyncTarget:
+        async def create(cls, cog, member, doc=None) -> GuildSync.SyncTarget:
             self = cls()
+            self.cog = cog
             self.member = member
-            doc = await cog.bot.database.get(member, cog)
+            self.to_add = set()
+            self.to_remove = set()
+            if doc is None:
+                doc = await cog.bot.database.get(member, cog)
             keys = doc.get("keys", [])
             if not keys:
                 key = doc.get("key")
@@ -316,19 +370,12 @@ class GuildSync:
             self.is_in_any_guild = False
             return self
 
-        async def add_roles(self, roles):
-            try:
-                coro = self.member.add_roles(*roles, reason="$guildsync")
-                await asyncio.wait_for(coro, timeout=5)
-            except (asyncio.TimeoutError, discord.Forbidden):
-                pass
-
-        async def remove_roles(self, roles):
-            try:
-                coro = self.member.remove_roles(*roles, reason="$guildsync")
-                await asyncio.wait_for(coro, timeout=5)
-            except (asyncio.TimeoutError, discord.Forbidden):
-                pass
+        async def apply(self):
+            """Apply the role changes collected from every sync at once"""
+            await self.cog.edit_member_roles(self.member,
+                                             add=self.to_add,
+                                             remove=self.to_remove,
+                                             reason="$guildsync")
 
         async def sync_membership(self, sync_guild: GuildSync.SyncGuild):
             lowest_order = float("inf")
@@ -365,16 +412,14 @@ class GuildSync:
             if sync_guild.tag_enabled and sync_guild.tag_role:
                 if not current_tag_role and belongs:
                     to_add.append(sync_guild.tag_role)
-            if to_add:
-                await self.add_roles(to_add)
+            self.to_add.update(to_add)
             to_remove = []
             for rank in current_rank_roles:
                 if rank != highest_rank:
                     to_remove.append(current_rank_roles[rank])
             if not belongs and current_tag_role:
                 to_remove.append(current_tag_role)
-            if to_remove:
-                await self.remove_roles(to_remove)
+            self.to_remove.update(to_remove)
 
     async def guildsync_autocomplete(self, interaction: discord.Interaction,
                                      current: str):
@@ -718,6 +763,9 @@ class GuildSync:
         if enabled is None:
             await self.bot.database.set(guild, {"guildsync.enabled": True},
                                         self)
+            enabled = True
+        if enabled:
+            self.guildsync_due.setdefault(guild.id, time.monotonic())
         await destination.send("Guildsync succesfully added!")
         await self.run_guildsyncs(guild)
 
@@ -732,6 +780,10 @@ class GuildSync:
         guild = interaction.guild
         await self.bot.database.set_guild(guild,
                                           {"guildsync.enabled": enabled}, self)
+        if enabled:
+            self.guildsync_due.setdefault(guild.id, time.monotonic())
+        else:
+            self.guildsync_due.pop(guild.id, None)
         if enabled:
             msg = ("Guildsync is now enabled. You may still need to "
                    "add guildsyncs using `guildsync add` before it "
@@ -786,23 +838,18 @@ class GuildSync:
             return False
 
     async def run_guildsyncs(self, guild, *, sync_for=None):
+        """Returns False if the guild has no guildsync to run"""
         guild_doc = await self.bot.database.get(guild, self)
         guildsync_doc = guild_doc.get("guildsync", {})
         enabled = guildsync_doc.get("enabled", False)
         if not enabled:
-            return
+            return False
         purge = guildsync_doc.get("purge", False)
         cursor = self.db.guildsyncs.find({"guild_id": guild.id})
-        targets = []
-        if sync_for:
-            target = targets.append(await
-                                    self.SyncTarget.create(self, sync_for))
-        else:
-            for member in guild.members:
-                target = await self.SyncTarget.create(self, member)
-                if target:
-                    targets.append(target)
+        syncs = []
+        configured = False
         async for doc in cursor:
+            configured = True
             try:
                 sync = self.SyncGuild(self, doc, guild)
                 await sync.synchronize_roles()
@@ -817,59 +864,193 @@ class GuildSync:
                     print("failed")
                     await sync.save(error=True)
                     continue
+                syncs.append(sync)
+            except Exception as e:
+                self.log.exception("Exception in guildsync", exc_info=e)
+        full = not sync_for and any(sync.needs_full_sync() for sync in syncs)
+        if sync_for:
+            members = [sync_for]
+        elif not full:
+            accounts = set()
+            for sync in syncs:
+                accounts |= sync.changed_accounts()
+            user_ids = self.account_index.lookup(accounts)
+            members = [guild.get_member(user_id) for user_id in user_ids]
+            members = [member for member in members if member]
+        else:
+            # Only members who are on one of the rosters or hold a role we
+            # manage can need changes
+            members = {}
+            user_ids = self.account_index.lookup(
+                account for sync in syncs for account in sync.members)
+            for user_id in user_ids:
+                member = guild.get_member(user_id)
+                if member:
+                    members[member.id] = member
+            for sync in syncs:
+                role_ids = [*sync.role_ids_to_ranks, sync.tag_role_id]
+                for role_id in role_ids:
+                    role = guild.get_role(role_id) if role_id else None
+                    if role:
+                        members.update((m.id, m) for m in role.members)
+            members = list(members.values())
+        docs = await self.get_many(members)
+        targets = [
+            await self.SyncTarget.create(self, member, docs[member.id])
+            for member in members
+        ]
+        reconciled = []
+        for sync in syncs:
+            try:
                 for target in targets:
                     await target.sync_membership(sync)
+                reconciled.append(sync)
             except Exception as e:
                 self.log.exception("Exception in guildsync", exc_info=e)
-        if purge:
-            for target in targets:
-                member = target.member
+        for target in targets:
+            await target.apply()
+        if not sync_for and self.account_index.loaded:
+            # A single member sync mustn't advance the snapshot, or the
+            # periodic run would miss the changes of everyone else. Neither
+            # may a run that couldn't look everyone up yet.
+            for sync in reconciled:
+                await sync.save(roster=True, full_sync=full)
+        # Members missing from a half loaded index would look like they
+        # aren't in any guild
+        if purge and self.account_index.loaded:
+            in_guild = {t.member.id for t in targets if t.is_in_any_guild}
+            in_guild |= self.account_index.lookup(
+                account for sync in syncs for account in sync.members)
+            candidates = [sync_for] if sync_for else guild.members
+            for member in candidates:
                 membership_duration = (datetime.utcnow() -
                                        member.joined_at).total_seconds()
-                if not target.is_in_any_guild:
+                if member.id not in in_guild:
                     if len(member.roles) == 1 and membership_duration > 172800:
                         try:
-                            await member.guild.kick(user=member,
-                                                    reason="$guildsync purge")
+                            await self.discord_writes.submit(
+                                guild.id, "kick", ("kick", member.id), member,
+                                lambda m: guild.kick(user=m,
+                                                     reason="$guildsync purge"))
                         except discord.Forbidden:
                             pass
+        return configured
+
+    async def guildsync_worker(self):
+        while True:
+            _, _, guild_id, member_id, due = await self.guildsync_queue.get()
+            try:
+                guild = self.bot.get_guild(guild_id)
+                if not guild:
+                    continue
+                member = guild.get_member(member_id) if member_id else None
+                if member_id and not member:
+                    continue
+                start = time.monotonic()
+                if due is not None:
+                    lag = start - due
+                    self.guildsync_stats["lag"] = lag
+                    self.guildsync_stats["max_lag"] = max(
+                        lag, self.guildsync_stats.get("max_lag", 0))
+                active = True
+                try:
+                    coro = self.run_guildsyncs(guild, sync_for=member)
+                    active = await asyncio.wait_for(coro,
+                                                    timeout=GUILDSYNC_TIMEOUT)
+                except asyncio.TimeoutError:
+                    self.log.warning(f"Guildsync timed out for {guild_id}")
+                except Exception as e:
+                    self.log.exception("Exception in guildsync", exc_info=e)
+                if member_id is None:
+                    # Disabled or removed while this ran, or no longer has
+                    # any syncs configured
+                    if not active or guild_id not in self.guildsync_due:
+                        self.guildsync_due.pop(guild_id, None)
+                    else:
+                        elapsed = time.monotonic() - start
+                        self.guildsync_due[guild_id] = time.monotonic() + max(
+                            GUILDSYNC_INTERVAL, elapsed * 2)
+            finally:
+                if member_id is None:
+                    self.guildsync_pending.discard(guild_id)
+                self.guildsync_queue.task_done()
 
     @tasks.loop(seconds=60)
     async def guildsync_consumer(self):
-        while True:
-            _, coro = await self.guildsync_queue.get()
-            await asyncio.wait_for(coro, timeout=300)
-            self.guildsync_queue.task_done()
-            await asyncio.sleep(0.5)
+        self.background_api_calls()
+        await asyncio.gather(
+            *[self.guildsync_worker() for _ in range(GUILDSYNC_WORKERS)])
 
     @guildsync_consumer.before_loop
     async def before_guildsync_consumer(self):
         await self.bot.wait_until_ready()
 
-    @tasks.loop(seconds=60)
-    async def guild_synchronizer(self):
+    async def rescan_guildsyncs(self):
+        """Refresh which guilds are due periodic syncs from the database"""
+        now = time.monotonic()
+        enabled = set()
         cursor = self.bot.database.iter("guilds", {"guildsync.enabled": True},
                                         self,
                                         batch_size=10)
         async for doc in cursor:
-            try:
-                if doc["_obj"]:
-                    coro = self.run_guildsyncs(doc["_obj"])
-                    await asyncio.wait_for(coro, timeout=200)
-            except asyncio.CancelledError:
-                return
-            except Exception:
-                pass
+            guild = doc["_obj"]
+            if guild:
+                enabled.add(guild.id)
+                self.guildsync_due.setdefault(guild.id, now)
+        for guild_id in list(self.guildsync_due):
+            if guild_id not in enabled:
+                del self.guildsync_due[guild_id]
+        self.guildsync_rescan_at = now + GUILDSYNC_RESCAN_INTERVAL
+
+    @tasks.loop(seconds=10)
+    async def guild_synchronizer(self):
+        now = time.monotonic()
+        if now >= self.guildsync_rescan_at:
+            await self.rescan_guildsyncs()
+        for guild_id, due in list(self.guildsync_due.items()):
+            if due > now or guild_id in self.guildsync_pending:
+                continue
+            guild = self.bot.get_guild(guild_id)
+            if guild:
+                self.schedule_guildsync(guild, due)
+        self.guildsync_stats["queued"] = self.guildsync_queue.qsize()
+        lag = self.guildsync_stats.get("max_lag", 0)
+        if lag > GUILDSYNC_INTERVAL:
+            self.log.info(f"Guildsync is lagging {lag:.0f} seconds behind, "
+                          f"{self.guildsync_stats['queued']} guilds queued")
+        self.guildsync_stats["max_lag"] = 0
 
     @guild_synchronizer.before_loop
     async def before_guild_synchronizer(self):
         await self.bot.wait_until_ready()
 
     def schedule_guildsync(self, guild, priority, *, member=None):
-        coro = self.run_guildsyncs(guild, sync_for=member)
+        """Queue a sync of guild, lowest priority first.
+
+        Periodic syncs use the time they became due as their priority, so the
+        guilds that have waited longest go first."""
         self.guildsync_entry_number += 1
-        self.guildsync_queue.put_nowait(
-            ((priority, self.guildsync_entry_number), coro))
+        if member:
+            entry = (priority, self.guildsync_entry_number, guild.id,
+                     member.id, None)
+        else:
+            self.guildsync_pending.add(guild.id)
+            entry = (priority, self.guildsync_entry_number, guild.id, None,
+                     priority)
+        self.guildsync_queue.put_nowait(entry)
+
+    def schedule_member_guildsyncs(self, user):
+        """Queue a sync of user in every guild with guildsync, for when
+        their keys change"""
+        for guild in user.mutual_guilds:
+            # Guilds with guildsync enabled all have a due time
+            if guild.id not in self.guildsync_due:
+                continue
+            member = guild.get_member(user.id)
+            if member:
+                self.schedule_guildsync(guild,
+                                        GUILDSYNC_PRIORITY_MEMBER,
+                                        member=member)
 
     @commands.Cog.listener("on_member_join")
     async def guildsync_on_member_join(self, member):
@@ -880,4 +1061,6 @@ class GuildSync:
         sync = doc.get("guildsync", {})
         enabled = sync.get("enabled", False)
         if enabled:
-            await self.run_guildsyncs(guild, sync_for=member)
+            self.schedule_guildsync(guild,
+                                    GUILDSYNC_PRIORITY_MEMBER,
+                                    member=member)
@@ -5,6 +5,12 @@ from discord import app_commands
 from .guild.general import guild_name_autocomplete
 
 
+def merge_role_changes(old, new):
+    old_add, old_remove, _ = old
+    add, remove, reason = new
+    return (old_add - remove) | add, (old_remove - add) | remove, reason
+
+
 class GuildManageMixin:
 
     @app_commands.guild_only()
@@ -18,6 +24,75 @@ class GuildManageMixin:
 
     server_group = ServerGroup(guild_only=True)
 
+    async def edit_member_roles(self, member, *, add=(), remove=(), reason=None):
+        """Add and remove roles with a single request. Roles in both add and
+        remove are added.
+
+        Goes through the Discord write scheduler, so changes for the same
+        member from different features are merged while queued."""
+        add = set(add)
+        remove = set(remove) - add
+        current = set(member.roles)
+        if not add - current and not remove & current:
+            return False
+
+        async def edit(target, add, remove, reason):
+            current = set(target.roles)
+            to_add = add - current
+            to_remove = remove & current
+            if not to_add and not to_remove:
+                return False
+            if len(to_add) + len(to_remove) == 1:
+                # Touches only that role, unlike replacing the whole set
+                if to_add:
+                    coro = target.add_roles(*to_add, reason=reason)
+                else:
+                    coro = target.remove_roles(*to_remove, reason=reason)
+            else:
+                roles = (current - remove) | add
+                roles.discard(member.guild.default_role)
+                coro = target.edit(roles=list(roles), reason=reason)
+            await asyncio.wait_for(coro, timeout=5)
+            return True
+
+        async def execute(payload):
+            add, remove, reason = payload
+            # The gateway keeps the cached member current, including changes
+            # made while this was queued
+            target = member.guild.get_member(member.id) or member
+            try:
+                try:
+                    return await edit(target, add, remove, reason)
+                except discord.HTTPException as e:
+                    if e.status == 429 or isinstance(e, discord.Forbidden):
+                        raise
+                # The cache may have been behind, try once more from a
+                # fresh copy
+                target = await member.guild.fetch_member(member.id)
+                return await edit(target, add, remove, reason)
+            except (asyncio.TimeoutError, discord.Forbidden, discord.NotFound):
+                return False
+
+        return await self.discord_writes.submit(member.guild.id,
+                                                "member", ("roles", member.id),
+                                                (add, remove, reason),
+                                                execute,
+                                                merge=merge_role_changes)
+
+    async def set_member_nick(self, member, nick, *, reason=None):
+
+        async def execute(nick):
+            try:
+                coro = member.edit(nick=nick, reason=reason)
+                await asyncio.wait_for(coro, timeout=5)
+            except (asyncio.TimeoutError, discord.Forbidden):
+                return False
+            return True
+
+        return await self.discord_writes.submit(member.guild.id, "member",
+                                                ("nick", member.id), nick,
+                                                execute)
+
     @server_group.command(name="force_account_names")
     @app_commands.checks.has_permissions(manage_nicknames=True)
     @app_commands.checks.bot_has_permissions(manage_nicknames=True)
@@ -137,6 +212,7 @@ class GuildManageMixin:
 
     @tasks.loop(minutes=5)
     async def key_sync_task(self):
+        self.background_api_calls()
         cursor = self.bot.database.iter("guilds", {"key_sync.enabled": True},
                                         self)
         async for doc in cursor:
@@ -164,10 +240,11 @@ class GuildManageMixin:
         role = guild.get_role(doc["key_sync"]["role"])
         if not role:
             return
+        docs = await self.get_many(guild.members)
         for member in guild.members:
-            await self.key_sync_user(member, role)
+            await self.key_sync_user(member, role, user_doc=docs[member.id])
 
-    async def key_sync_user(self, member, role=None):
+    async def key_sync_user(self, member, role=None, *, user_doc=None):
         guild = member.guild
         if not guild.me.guild_permissions.manage_roles:
             return
@@ -179,34 +256,36 @@ class GuildManageMixin:
             role = guild.get_role(doc["key_sync"]["role"])
         if not role:
             return
-        user_doc = await self.bot.database.get(member, self)
+        if user_doc is None:
+            user_doc = await self.bot.database.get(member, self)
         has_key = False
         if user_doc.get("key", {}).get("key"):
             has_key = True
-        try:
-            if has_key:
-                if role not in member.roles:
-                    await member.add_roles(role, reason="/server api_key_role")
-            else:
-                if role in member.roles:
-                    await member.remove_roles(
-                        role,
-                        reason="/server api_key_role is enabled. Member "
-                        "lacks a valid API key.")
-        except discord.Forbidden:
-            return
+        if has_key:
+            await self.edit_member_roles(member,
+                                         add=[role],
+                                         reason="/server api_key_role")
+        else:
+            await self.edit_member_roles(
+                member,
+                remove=[role],
+                reason="/server api_key_role is enabled. Member "
+                "lacks a valid API key.")
 
     @key_sync_task.before_loop
     async def before_forced_account_names(self):
         await self.bot.wait_until_ready()
 
     async def force_guild_account_names(self, guild):
+        docs = await self.get_many(guild.members)
         for member in guild.members:
             try:
-                key = await self.fetch_key(member)
+                key = docs[member.id].get("key")
+                if not key:
+                    continue
                 name = key["account_name"]
                 if name.lower() not in member.display_name.lower():
-                    await member.edit(nick=name,
-                                      reason="Force account names - /server")
+                    await self.set_member_nick(
+                        member, name, reason="Force account names - /server")
             except Exception:
                 pass
@@ -4,12 +4,16 @@ import discord
 from discord import app_commands
 from discord.app_commands import Choice
 from .exceptions import APIError, APIInactiveError
+from .utils.accounts import accounts_from_doc
 
 
 class KeyMixin:
 
     key_group = app_commands.Group(name="key", description="API key management")
 
+    async def load_account_index(self):
+        await self.account_index.load(self.bot.database.users)
+
     @key_group.command(name="add")
     @app_commands.describe(
         token="Generate at https://account.arena.net under Applications tab"
@@ -54,6 +58,9 @@ class KeyMixin:
         await self.bot.database.set(
             interaction.user, {"key": key_doc, "keys": keys}, self
         )
+        await self.account_index.update(
+            interaction.user.id, accounts_from_doc({"key": key_doc, "keys": keys})
+        )
         if len(keys) > 1:
             output = (
                 "Your key was verified and "
@@ -147,6 +154,10 @@ class KeyMixin:
         await self.bot.database.set(
             interaction.user, {"key": key, "keys": to_keep}, self
         )
+        await self.account_index.update(
+            interaction.user.id, accounts_from_doc({"key": key, "keys": to_keep})
+        )
+        self.schedule_member_guildsyncs(interaction.user)
         await interaction.followup.send("Key removed.")
 
     @key_group.command(name="info")
@@ -189,6 +200,10 @@ class KeyMixin:
                 "That key is not in your account.", ephemeral=True
             )
         await self.bot.database.set(interaction.user, {"key": k}, self)
+        await self.account_index.update(
+            interaction.user.id, accounts_from_doc({"key": k, "keys": keys})
+        )
+        self.schedule_member_guildsyncs(interaction.user)
         msg = "Swapped to selected key."
         if key["name"]:
             msg += " Name : `{}`".format(k["name"])
@@ -14,6 +14,28 @@ from discord.ext import tasks
 
 from .daily import DAILY_CATEGORIES
 from .exceptions import APIError
+from .utils.broadcast import render_variant
+
+
+async def edit_message_by_id(channel, message_id, **fields):
+    """Edit one of our messages without fetching it first. Returns None if
+    it is gone; other errors are left to the caller."""
+    try:
+        return await channel.get_partial_message(message_id).edit(**fields)
+    except discord.NotFound:
+        return None
+
+
+async def delete_message_by_id(channel, message_id):
+    # Best effort, the replacement has already been sent
+    try:
+        await channel.get_partial_message(message_id).delete()
+    except discord.HTTPException:
+        pass
+
+
+async def load_embeds(embeds):
+    return [discord.Embed.from_dict(embed) for embed in embeds]
 
 
 class DailyCategoriesDropdown(discord.ui.Select):
@@ -56,6 +78,7 @@ class DailyCategoriesDropdown(discord.ui.Select):
             "daily.autodelete": autodelete,
             "daily.autoedit": autoedit,
             "daily.categories": categories,
+            "daily.pinned": None,
         }
         await self.cog.bot.database.set(interaction.guild, settings, self.cog)
         await interaction.edit_original_response(
@@ -361,7 +384,7 @@ class NotiifiersMixin:
             )
         event_name = event_name.lower()
         reminder = {}
-        for boss in self.boss_schedule:
+        for boss in self.boss_timeline.events:
             if boss["name"].lower() == event_name:
                 reminder["type"] = "boss"
                 reminder["name"] = boss["name"]
@@ -385,6 +408,7 @@ class NotiifiersMixin:
         await self.bot.database.set(
             interaction.user, {"event_reminders": reminder}, self, operator="push"
         )
+        await self.reload_event_reminders(interaction.user.id)
         await interaction.response.send_message(
             "Reminder set succesfully", ephemeral=True
         )
@@ -686,51 +710,113 @@ class NotiifiersMixin:
         else:
             return False
 
-    @tasks.loop(time=[datetime.time(hour=23, minute=40, tzinfo=datetime.timezone.utc)])
-    async def send_daily_notifs(self):
-        await self.cache_dailies(tomorrow=True)
-        cursor = self.bot.database.iter(
-            "guilds",
-            {"daily.on": True, "daily.channel": {"$ne": None}},
-            self,
-            subdocs=["daily"],
+    def broadcast_kinds(self):
+        """kind: (subscription query, subdoc, deliver, checkpoint, max_age)
+
+        Unfinished broadcasts older than max_age aren't resumed."""
+        return {
+            "dailies": (
+                {"daily.on": True, "daily.channel": {"$ne": None}},
+                "daily",
+                self.deliver_daily,
+                True,
+                # Sent at 23:40 for the next day, stale once it starts
+                datetime.timedelta(minutes=20),
+            ),
+            "news": (
+                {"news.on": True, "news.channel": {"$ne": None}},
+                "news",
+                self.deliver_news,
+                True,
+                datetime.timedelta(days=1),
+            ),
+            "updates": (
+                {"updates.on": True, "updates.channel": {"$ne": None}},
+                "updates",
+                self.deliver_update,
+                True,
+                datetime.timedelta(hours=6),
+            ),
+            # A late boss timer is useless, no point resuming it
+            "bossnotifs": (
+                {"bossnotifs.on": True, "bossnotifs.channel": {"$ne": None}},
+                "bossnotifs",
+                self.deliver_bossnotif,
+                False,
+                None,
+            ),
+        }
+
+    async def broadcast(self, kind, payload, *, broadcast_id=None):
+        query, subdoc, deliver, checkpoint, _ = self.broadcast_kinds()[kind]
+        if not broadcast_id:
+            now = datetime.datetime.utcnow().isoformat()
+            broadcast_id = f"{kind}:{now}"
+        return await self.broadcaster.run(
+            kind, broadcast_id, query, subdoc, payload, deliver, checkpoint=checkpoint
         )
-        daily_doc = await self.bot.database.get_cog_config(self)
-
-        async def notify_guild(doc):
-            categories = doc.get("categories")
-            if not categories:
-                categories = [
-                    "psna",
-                    "psna_later",
-                    "pve",
-                    "pvp",
-                    "wvw",
-                    "fractals",
-                    "strikes",
-                ]
-            if "psna" in categories and "psna_later" not in categories:
-                categories.insert(categories.index("psna") + 1, "psna_later")
-            channel = self.bot.get_channel(doc["channel"])
-
-            if not channel:
-                return
-            can_embed = channel.permissions_for(channel.guild.me).embed_links
-            can_send = channel.permissions_for(channel.guild.me).send_messages
-            can_see_history = channel.permissions_for(
-                channel.guild.me
-            ).read_message_history
-            if not can_send:
-                return
-            if not can_embed:
-                return await channel.send(
-                    "Need permission to "
-                    "embed links in order "
-                    "to send daily "
-                    "notifs!"
-                )
+
+    async def resume_broadcasts(self):
+        await self.bot.wait_until_ready()
+        kinds = self.broadcast_kinds()
+        now = datetime.datetime.utcnow()
+        for state in await self.broadcaster.pending():
+            if state["kind"] not in kinds:
+                continue
+            max_age = kinds[state["kind"]][4]
+            if max_age is None or now - state["started"] > max_age:
+                self.log.info(f"Dropping stale broadcast {state['_id']}")
+                await self.broadcaster.discard(state["_id"])
+                continue
+            self.log.info(f"Resuming broadcast {state['_id']}")
+            await self.broadcast(
+                state["kind"], state["payload"], broadcast_id=state["_id"]
+            )
+
+    async def deliver_daily(self, doc, dailies, variants):
+        categories = doc.get("categories")
+        if not categories:
+            categories = [
+                "psna",
+                "psna_later",
+                "pve",
+                "pvp",
+                "wvw",
+                "fractals",
+                "strikes",
+            ]
+        if "psna" in categories and "psna_later" not in categories:
+            categories.insert(categories.index("psna") + 1, "psna_later")
+        channel = self.bot.get_channel(doc["channel"])
+
+        if not channel:
+            return
+        can_embed = channel.permissions_for(channel.guild.me).embed_links
+        can_send = channel.permissions_for(channel.guild.me).send_messages
+        can_see_history = channel.permissions_for(
+            channel.guild.me
+        ).read_message_history
+        if not can_send:
+            return
+        if not can_embed:
+            return await channel.send(
+                "Need permission to "
+                "embed links in order "
+                "to send daily "
+                "notifs!"
+            )
+        # The embed only depends on the categories and on whether the
+        # channel can use our emojis, so guilds share a render
+        can_use_emojis = channel.permissions_for(
+            channel.guild.me
+        ).external_emojis
+
+        async def render():
             embed = await self.daily_embed(
-                categories, doc=daily_doc, interaction=channel, tomorrow=True
+                categories,
+                doc={"cache": {"dailies_tomorrow": dailies}},
+                interaction=channel,
+                tomorrow=True,
             )
             embed.title = "Dailies"
             tomorrow = datetime.datetime.now(
@@ -738,156 +824,136 @@ class NotiifiersMixin:
             ) + datetime.timedelta(days=1)
             tomorrow = tomorrow.replace(hour=0, minute=0, second=0, microsecond=0)
             embed.timestamp = tomorrow
-            edit = doc.get("autoedit", False)
-            autodelete = doc.get("autodelete", False)
-            old_message = None
-            if (autodelete or edit) and can_see_history:
-                try:
-                    old_message_id = doc.get("message")
-                    if old_message_id:
-                        old_message = await channel.fetch_message(old_message_id)
-                except discord.HTTPException:
-                    pass
-            edited = False
             embed.set_thumbnail(
                 url="https://wiki.guildwars2.com/images/" "1/14/Daily_Achievement.png"
             )
-            if old_message and edit:
-                try:
-                    await old_message.edit(embed=embed)
-                    edited = True
-                except discord.HTTPException:
-                    pass
-            if not edited:
-                message = await channel.send(embed=embed)
-            if old_message and autodelete and not edited:
+            return embed
+
+        embed = await render_variant(
+            variants, (tuple(categories), can_use_emojis), render
+        )
+        edit = doc.get("autoedit", False)
+        autodelete = doc.get("autodelete", False)
+        old_message_id = doc.get("message")
+        message = None
+        if old_message_id and edit:
+            message = await edit_message_by_id(channel, old_message_id,
+                                               embed=embed)
+        edited = message is not None
+        if not edited:
+            message = await self.broadcaster.send(channel, embed=embed)
+            if old_message_id and autodelete:
+                await delete_message_by_id(channel, old_message_id)
+            await self.bot.database.set_guild(
+                channel.guild, {"daily.message": message.id}, self
+            )
+        autopin = doc.get("autopin", False)
+        pinned = doc.get("pinned")
+        if not autopin or (edited and pinned == message.id):
+            return
+        if "pinned" not in doc:
+            # Pinned before the pin was tracked, when it was always the
+            # last message
+            pinned = old_message_id
+        try:
+            await message.pin()
+            try:
+                if can_see_history:
+                    async for m in channel.history(after=message, limit=3):
+                        if (
+                            m.type == discord.MessageType.pins_add
+                            and m.author == self.bot.user
+                        ):
+                            await m.delete()
+                            break
+            except Exception:
+                pass
+            if pinned and pinned != message.id:
                 try:
-                    await old_message.delete()
+                    await channel.get_partial_message(pinned).unpin()
                 except discord.HTTPException:
                     pass
-            if not edited:
-                await self.bot.database.set_guild(
-                    channel.guild, {"daily.message": message.id}, self
-                )
-            autopin = doc.get("autopin", False)
-            if autopin:
-                message = old_message
-                if edited:
-                    if message.pinned:
-                        return
-                try:
-                    await message.pin()
-                    try:
-                        if can_see_history:
-                            async for m in channel.history(after=message, limit=3):
-                                if (
-                                    m.type == discord.MessageType.pins_add
-                                    and m.author == self.bot.user
-                                ):
-                                    await m.delete()
-                                    break
-                    except Exception:
-                        pass
-                    if not edited:
-                        old_message = doc.get("message")
-                        if old_message:
-                            to_unpin = await channel.fetch_message(old_message)
-                            await to_unpin.unpin()
-                except Exception:
-                    pass
+            await self.bot.database.set_guild(
+                channel.guild, {"daily.pinned": message.id}, self
+            )
+        except Exception:
+            pass
 
-        async for doc in cursor:
-            asyncio.create_task(notify_guild(doc))
-            await asyncio.sleep(0.1)
+    @tasks.loop(time=[datetime.time(hour=23, minute=40, tzinfo=datetime.timezone.utc)])
+    async def send_daily_notifs(self):
+        self.background_api_calls()
+        await self.cache_dailies(tomorrow=True)
+        doc = await self.bot.database.get_cog_config(self)
+        await self.broadcast("dailies", doc["cache"]["dailies_tomorrow"])
 
     @send_daily_notifs.error
     async def swap_daily_tomorrow_and_today_error(self, error):
         self.log.exception("Error while sending dailies", exc_info=error)
         self.send_daily_notifs.restart()
 
-    async def send_news(self, embeds):
-        cursor = self.bot.database.iter(
-            "guilds",
-            {"news.on": True, "news.channel": {"$ne": None}},
-            self,
-            subdocs=["news"],
-        )
+    async def deliver_news(self, doc, embeds, variants):
         to_filter = ["the arenanet streaming schedule", "community showcase"]
-        filtered = [
-            embed.title
-            for embed in embeds
-            if any(f in embed.title.lower() for f in to_filter)
-        ]
-        async for doc in cursor:
-            try:
-                if not doc["_obj"]:
-                    continue
-                channel = self.bot.get_channel(doc["channel"])
-                if not channel:
+        channel = self.bot.get_channel(doc["channel"])
+        if not channel:
+            return
+        filter_on = doc.get("filter", True)
+        role_id = doc.get("role")
+        content = None
+        if role_id:
+            role = channel.guild.get_role(role_id)
+            if role:
+                content = role.mention
+        embeds = await render_variant(
+            variants, "embeds", lambda: load_embeds(embeds)
+        )
+        for embed in embeds:
+            if filter_on:
+                if any(f in embed.title.lower() for f in to_filter):
                     continue
-                filter_on = doc.get("filter", True)
-                role_id = doc.get("role")
-                content = None
-                if role_id:
-                    role = channel.guild.get_role(role_id)
-                    if role:
-                        content = role.mention
-                for embed in embeds:
-                    if filter_on:
-                        if embed.title in filtered:
-                            continue
-                    await channel.send(content, embed=embed)
-            except discord.Forbidden:
-                await self.bot.database.set(doc["_obj"], {"news.on": False}, self)
-            except Exception as e:
-                self.log.exception(e)
+            await self.broadcaster.send(channel, content, embed=embed)
+
+    async def send_news(self, embeds):
+        await self.broadcast("news", [embed.to_dict() for embed in embeds])
+
+    async def deliver_update(self, doc, updates, variants):
+        if not doc["on"]:
+            return
+        channel = self.bot.get_channel(doc["channel"])
+        if not channel:
+            return
+        embeds = await render_variant(
+            variants, "embeds", lambda: load_embeds([u["embed"] for u in updates])
+        )
+        for update, embed in zip(updates, embeds):
+            if not update["minor"]:
+                mention = doc.get("mention", "")
+                if (
+                    mention == "everyone" or mention == "here"
+                ):  # Legacy, too lazy to update atm, TODO
+                    mention = "@" + mention
+                if mention == "none":
+                    mention = ""
+            else:
+                mention = ""
+            if channel.permissions_for(channel.guild.me).embed_links:
+                message = mention + " Guild Wars 2 has just updated!"
+                await self.broadcaster.send(channel, message, embed=embed)
+            else:
+                await self.broadcaster.send(channel, update["text"])
 
     async def send_update_notifs(self):
         doc = await self.bot.database.get_cog_config(self)
         build = doc["cache"]["build"]
-        embed_available = False
         try:
             result = await self.update_notification(build)
             if not result:
                 return
-            for embed, text, minor in result:
-                embed_available = True
-                cursor = self.bot.database.iter(
-                    "guilds",
-                    {"updates.on": True, "updates.channel": {"$ne": None}},
-                    self,
-                    subdocs=["updates"],
-                )
-                sent = 0
-                async for doc in cursor:
-                    try:
-                        if not doc["on"]:
-                            continue
-                        channel = self.bot.get_channel(doc["channel"])
-                        if not channel:
-                            continue
-                        if not minor:
-                            mention = doc.get("mention", "")
-                            if (
-                                mention == "everyone" or mention == "here"
-                            ):  # Legacy, too lazy to update atm, TODO
-                                mention = "@" + mention
-                            if mention == "none":
-                                mention = ""
-                        else:
-                            mention = ""
-                        if (
-                            channel.permissions_for(channel.guild.me).embed_links
-                            and embed_available
-                        ):
-                            message = mention + " Guild Wars 2 has just updated!"
-                            await channel.send(message, embed=embed)
-                        else:
-                            await channel.send(text)
-                        sent += 1
-                    except Exception as e:
-                        self.log.exception(e)
-                self.log.info("Update notifs: sent {}".format(sent))
+            updates = [
+                {"embed": embed.to_dict(), "text": text, "minor": minor}
+                for embed, text, minor in result
+            ]
+            stats = await self.broadcast("updates", updates)
+            self.log.info("Update notifs: sent {}".format(stats["delivered"]))
         except Exception as e:
             self.log.exception(e)
 
@@ -910,8 +976,9 @@ class NotiifiersMixin:
 
     @tasks.loop(minutes=1)
     async def game_update_checker(self):
+        self.background_api_calls()
         if await self.game_build_changed():
-            await self.rebuild_database()
+            await self.rebuild_database(incremental=True)
         await self.send_update_notifs()
 
     @game_update_checker.before_loop
@@ -920,6 +987,7 @@ class NotiifiersMixin:
 
     @tasks.loop(minutes=5)
     async def gem_tracker(self):
+        self.background_api_calls()
         cost = await self.get_gem_price()
         cost_coins = self.gold_to_coins(None, cost)
         cursor = self.bot.database.iter("users", {"gemtrack": {"$ne": None}}, self)
@@ -945,54 +1013,36 @@ class NotiifiersMixin:
     async def before_gem_tracker(self):
         await self.bot.wait_until_ready()
 
+    async def deliver_bossnotif(self, doc, embed, variants):
+        edit = doc.get("edit", False)
+        channel = self.bot.get_channel(doc["channel"])
+        if not channel:
+            return
+        old_message_id = doc.get("message")
+        if edit and old_message_id:
+            if await edit_message_by_id(channel, old_message_id, embed=embed):
+                return
+        try:
+            message = await self.broadcaster.send(channel, embed=embed)
+        except discord.Forbidden:
+            await channel.send(
+                "Need permission to "
+                "embed links in order "
+                "to send boss "
+                "notifs!"
+            )
+            return
+        await self.bot.database.set(
+            channel.guild, {"bossnotifs.message": message.id}, self
+        )
+        if old_message_id:
+            await delete_message_by_id(channel, old_message_id)
+
     @tasks.loop(minutes=5)
     async def boss_notifier(self):
-        name = self.__class__.__name__
         boss = self.get_upcoming_bosses(1)[0]
         await asyncio.sleep(boss["diff"].total_seconds() + 1)
-        cursor = self.bot.database.get_guilds_cursor(
-            {"bossnotifs.on": True, "bossnotifs.channel": {"$ne": None}}, self
-        )
-        async for doc in cursor:
-            try:
-                doc = doc["cogs"][name]["bossnotifs"]
-                edit = doc.get("edit", False)
-                channel = self.bot.get_channel(doc["channel"])
-                embed = self.schedule_embed(2)
-                old_message_id = doc.get("message")
-                edited = False
-                try:
-                    if edit and old_message_id:
-                        old_message = await channel.fetch_message(old_message_id)
-                        if old_message:
-                            try:
-                                await old_message.edit(embed=embed)
-                                edited = True
-                                continue
-                            except discord.HTTPException:
-                                pass
-                    message = await channel.send(embed=embed)
-                except discord.Forbidden:
-                    message = await channel.send(
-                        "Need permission to "
-                        "embed links in order "
-                        "to send boss "
-                        "notifs!"
-                    )
-                    continue
-                if not edited:
-                    await self.bot.database.set(
-                        channel.guild, {"bossnotifs.message": message.id}, self
-                    )
-                    old_message_id = doc.get("message")
-                    if old_message_id:
-                        to_delete = await channel.fetch_message(old_message_id)
-                        await to_delete.delete()
-            except asyncio.CancelledError:
-                return
-            except Exception:
-                pass
-            await asyncio.sleep(0.1)
+        await self.broadcast("bossnotifs", self.schedule_embed(2))
 
     @boss_notifier.before_loop
     async def before_boss_notifier(self):
@@ -1000,6 +1050,7 @@ class NotiifiersMixin:
 
     @tasks.loop(minutes=15)
     async def world_population_checker(self):
+        self.background_api_calls()
         await self.send_population_notifs()
         await asyncio.sleep(300)
         await self.cache_endpoint("worlds", True)
@@ -14,7 +14,6 @@ from discord.app_commands import Choice
 from PIL import Image, ImageDraw
 
 from .utils.chat import cleanup_xml_tags, embed_list_lines
-from .utils.db import prepare_search
 
 CHATCODE_REGEX = re.compile(r"\[\&(?=[^\s\[\]]*\])(.*?)\]")
 TILESERVICE_BASE_URL = "https://tiles.guildwars2.com/"
@@ -33,7 +32,7 @@ class Build:
         code = chatcode[2:-1]
         code = base64.b64decode(code)
         fields = struct.unpack("8B10H4B6H", code[:44])
-        profession_doc = await cog.db.professions.find_one({"code": fields[1]})
+        profession_doc = await cog.static.fetch_by("professions", "code", fields[1])
         specializations = []
         for spec, traits in zip(*[iter(fields[2:8])] * 2):
             if spec == 0:
@@ -43,14 +42,14 @@ class Build:
             bit_string = bit_string.zfill(6)
             indexes = [int(bit_string[i : i + 2], 2) - 1 for i in range(0, 6, 2)]
             indexes.reverse()
-            spec_doc = await cog.db.specializations.find_one({"_id": spec})
+            spec_doc = await cog.static.fetch("specializations", spec)
             indexes = [t + i for t, i in zip(indexes, range(0, 9, 3)) if t >= 0]
             active_traits = []
             for i in indexes:
                 active_traits.append(spec_doc["major_traits"][i])
-            trait_docs = {}
-            for trait in spec_doc["minor_traits"] + spec_doc["major_traits"]:
-                trait_docs[trait] = await cog.db.traits.find_one({"_id": trait})
+            trait_ids = spec_doc["minor_traits"] + spec_doc["major_traits"]
+            traits = await cog.static.fetch_many("traits", trait_ids)
+            trait_docs = {trait: traits.get(trait) for trait in trait_ids}
             specializations.append(
                 {
                     "spec_doc": spec_doc,
@@ -62,11 +61,11 @@ class Build:
         skills = []
         if profession_doc["_id"] == "Ranger":
             for pet in [fields[18], fields[19]]:
-                pet = await cog.db.pets.find_one({"_id": pet})
+                pet = await cog.static.fetch("pets", pet)
                 skills.append(pet)
         if profession_doc["_id"] == "Revenant":
             for legend in [fields[18], fields[19]]:
-                legend_doc = await cog.db.legends.find_one({"code": legend})
+                legend_doc = await cog.static.fetch_by("legends", "code", legend)
                 skill_ids.append(legend_doc["swap"])
         else:
             palettes = []
@@ -77,8 +76,9 @@ class Build:
                     if palette == palette_id:
                         skill_ids.append(skill_id)
                         break
+        skill_docs = await cog.static.fetch_many("skills", skill_ids)
         for skill_id in skill_ids:
-            skills.append(await cog.db.skills.find_one({"_id": skill_id}))
+            skills.append(skill_docs.get(skill_id))
         profession = await cog.get_profession(
             profession_doc["name"], [x["spec_doc"] for x in specializations]
         )
@@ -86,8 +86,8 @@ class Build:
 
     @classmethod
     async def from_build_tab(cls, cog, build_tab):
-        profession_doc = await cog.db.professions.find_one(
-            {"_id": build_tab["build"]["profession"]}
+        profession_doc = await cog.static.fetch(
+            "professions", build_tab["build"]["profession"]
         )
 
         async def get_skills(tab, terrestrial=True):
@@ -105,8 +105,9 @@ class Build:
                     skill_ids += skill
                     continue
                 skill_ids.append(skill)
+            fetched_skills = await cog.static.fetch_many("skills", skill_ids)
             for skill_id in skill_ids:
-                skill_doc = await cog.db.skills.find_one({"_id": skill_id})
+                skill_doc = fetched_skills.get(skill_id)
                 if not skill_doc:
                     continue
                 for palette_id, skill_id_2 in profession_doc["skills_by_palette"]:
@@ -121,11 +122,11 @@ class Build:
             if legends:
                 for legend in legends:
                     if legend:
-                        legend_doc = await cog.db.legends.find_one({"_id": legend})
+                        legend_doc = await cog.static.fetch("legends", legend)
                         if not legend_doc:
                             continue
                         swap_skill_docs.append(
-                            await cog.db.skills.find_one({"_id": legend_doc["swap"]})
+                            await cog.static.fetch("skills", legend_doc["swap"])
                         )
                         utility_palettes = []
                         for utility_skill in legend_doc["utilities"]:
@@ -142,7 +143,7 @@ class Build:
                 key = "terrestrial" if terrestrial else "aquatic"
                 for pet in pets[key]:
                     if pet:
-                        pet_docs.append(await cog.db.pets.find_one({"_id": pet}))
+                        pet_docs.append(await cog.static.fetch("pets", pet))
 
             Skills = collections.namedtuple(
                 "Skills", ["skill_docs", "legend_docs", "swap_skill_docs", "pet_docs"]
@@ -159,12 +160,12 @@ class Build:
                 continue
             if spec["id"] == 0:
                 continue
-            spec_doc = await cog.db.specializations.find_one({"_id": spec["id"]})
+            spec_doc = await cog.static.fetch("specializations", spec["id"])
             if not spec_doc:
                 continue
-            trait_docs = {}
-            for trait in spec_doc["minor_traits"] + spec_doc["major_traits"]:
-                trait_docs[trait] = await cog.db.traits.find_one({"_id": trait})
+            trait_ids = spec_doc["minor_traits"] + spec_doc["major_traits"]
+            traits = await cog.static.fetch_many("traits", trait_ids)
+            trait_docs = {trait: traits.get(trait) for trait in trait_ids}
             specs.append(
                 {
                     "spec_doc": spec_doc,
@@ -350,17 +351,18 @@ class SkillsMixin:
     async def skill_autocomplete(self, interaction: discord.Interaction, current: str):
         if not current:
             return []
-        query = prepare_search(current)
-        query = {"name": query, "professions": {"$ne": None}}
-        items = await self.db.skills.find(query).to_list(25)
+        items = await self.search_collection(
+            "skills",
+            current,
+            predicate=lambda it: it.get("professions") is not None,
+            query={"professions": {"$ne": None}},
+        )
         return [Choice(name=it["name"], value=str(it["_id"])) for it in items]
 
     async def trait_autocomplete(self, interaction: discord.Interaction, current: str):
         if not current:
             return []
-        query = prepare_search(current)
-        query = {"name": query}
-        items = await self.db.traits.find(query).to_list(25)
+        items = await self.search_collection("traits", current)
         return [Choice(name=it["name"], value=str(it["_id"])) for it in items]
 
     @app_commands.command(name="skill")
@@ -381,7 +383,7 @@ class SkillsMixin:
                     "Could not find any skills with that name."
                 )
         await interaction.response.defer()
-        choice = await self.db.skills.find_one({"_id": skill_id})
+        choice = await self.static.fetch("skills", skill_id)
         data = await self.skill_embed(choice, interaction)
         await interaction.followup.send(embed=data)
 
@@ -401,7 +403,7 @@ class SkillsMixin:
                 return await interaction.followup.send(
                     "Could not find any traits with that name."
                 )
-        choice = await self.db.traits.find_one({"_id": trait_id})
+        choice = await self.static.fetch("traits", trait_id)
         data = await self.skill_embed(choice, interaction)
         await interaction.followup.send(embed=data)
 
@@ -827,9 +829,7 @@ class SkillsMixin:
                                 "<I", data[6 + offset : 9 + offset] + b"\0"
                             )
                             upgrade_id = upgrade_id[0]
-                            upgrade_doc = await self.db.items.find_one(
-                                {"_id": upgrade_id}
-                            )
+                            upgrade_doc = await self.fetch_item(upgrade_id)
                             if not upgrade_doc:
                                 upgrades.append("Unknown upgrade")
                                 continue
@@ -883,7 +883,7 @@ class SkillsMixin:
                 case "Skill":
                     data = struct.unpack("<I", data[1:])
                     skill_id = data[0]
-                    skill_doc = await self.db.skills.find_one({"_id": skill_id})
+                    skill_doc = await self.static.fetch("skills", skill_id)
                     if not skill_doc:
                         return
                     new_embed = await self.skill_embed(skill_doc, message)
@@ -896,7 +896,7 @@ class SkillsMixin:
                 case "Trait":
                     data = struct.unpack("<I", data[1:])
                     trait_id = data[0]
-                    trait_doc = await self.db.traits.find_one({"_id": trait_id})
+                    trait_doc = await self.static.fetch("traits", trait_id)
                     if not trait_doc:
                         return
                     new_embed = await self.skill_embed(trait_doc, message)
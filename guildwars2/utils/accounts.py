@@ -0,0 +1,101 @@
+import collections
+
+from pymongo import ReplaceOne
+
+
+def accounts_from_doc(doc):
+    """Account names of every key stored in a user's cog document"""
+    keys = list(doc.get("keys", []))
+    key = doc.get("key")
+    if key and key not in keys:
+        keys.append(key)
+    return {k["account_name"] for k in keys if k and k.get("account_name")}
+
+
+class AccountIndex:
+    """Maps GW2 account names to the Discord users who have a key for them.
+
+    Kept in memory and mirrored to a collection so it survives restarts
+    without rescanning every user."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.by_account = collections.defaultdict(set)
+        self.by_user = {}
+        # Lookups are incomplete until the first load finishes
+        self.loaded = False
+
+    def _add(self, user_id, accounts, by_account=None, by_user=None):
+        by_account = self.by_account if by_account is None else by_account
+        by_user = self.by_user if by_user is None else by_user
+        by_user[user_id] = set(accounts)
+        for account in accounts:
+            by_account[account].add(user_id)
+
+    def _remove(self, user_id):
+        for account in self.by_user.pop(user_id, ()):
+            users = self.by_account.get(account)
+            if users:
+                users.discard(user_id)
+                if not users:
+                    del self.by_account[account]
+
+    async def load(self, users, *, rebuild=False):
+        """Load the index, building it from the users collection if it has
+        never been persisted or rebuild is set.
+
+        The new index is built on the side and swapped in once complete,
+        so lookups never see it half filled."""
+        by_account = collections.defaultdict(set)
+        by_user = {}
+        if not rebuild:
+            async for doc in self.collection.find({}):
+                self._add(doc["_id"], doc["accounts"], by_account, by_user)
+        if not by_user:
+            cursor = users.find(
+                {"cogs.GuildWars2.key": {
+                    "$nin": [None, {}]
+                }}, {
+                    "cogs.GuildWars2.key": 1,
+                    "cogs.GuildWars2.keys": 1
+                })
+            requests = []
+            async for doc in cursor:
+                accounts = accounts_from_doc(doc["cogs"]["GuildWars2"])
+                if not accounts:
+                    continue
+                self._add(doc["_id"], accounts, by_account, by_user)
+                requests.append(
+                    ReplaceOne({"_id": doc["_id"]},
+                               {"accounts": list(accounts)},
+                               upsert=True))
+            if rebuild:
+                await self.collection.delete_many(
+                    {"_id": {
+                        "$nin": list(by_user)
+                    }})
+            if requests:
+                await self.collection.bulk_write(requests, ordered=False)
+        self.by_account = by_account
+        self.by_user = by_user
+        self.loaded = True
+
+    async def update(self, user_id, accounts):
+        accounts = set(accounts)
+        if self.by_user.get(user_id, set()) == accounts:
+            return
+        self._remove(user_id)
+        if accounts:
+            self._add(user_id, accounts)
+            await self.collection.replace_one({"_id": user_id},
+                                              {"accounts": list(accounts)},
+                                              upsert=True)
+        else:
+            await self.collection.delete_one({"_id": user_id})
+
+    def lookup(self, accounts):
+        """User ids holding a key for any of the given accounts"""
+        found = set()
+        for account in accounts:
+            found |= self.by_account.get(account, set())
+        return found
@@ -0,0 +1,167 @@
+import asyncio
+import collections
+import datetime
+import logging
+
+import discord
+
+log = logging.getLogger(__name__)
+
+
+async def render_variant(variants, key, render):
+    """Return the variant for key from a broadcast's variants, awaiting
+    render() the first time it is asked for"""
+    task = variants.get(key)
+    if task is None:
+        task = asyncio.ensure_future(render())
+        variants[key] = task
+    # Shield so one cancelled guild doesn't cancel everyone else's render
+    return await asyncio.shield(task)
+
+
+class Broadcaster:
+    """Delivers one payload to every guild matching a subscription query.
+
+    Guilds are served concurrently up to a limit. Messages sent through send
+    are retried with backoff on transient Discord errors, and a Forbidden
+    turns the subscription off.
+    Delivered guilds are checkpointed, so a broadcast interrupted by a
+    restart picks up where it stopped.
+
+    deliver gets a dict of renders alongside the payload, so anything built
+    from it through render_variant is built once per broadcast and shared by
+    every guild needing the same variant."""
+
+    def __init__(self,
+                 cog,
+                 collection,
+                 *,
+                 concurrency=20,
+                 retries=3,
+                 flush_every=50):
+        self.cog = cog
+        self.collection = collection
+        self.concurrency = concurrency
+        self.retries = retries
+        self.flush_every = flush_every
+
+    async def send(self, destination, *args, **kwargs):
+        """destination.send, retrying just this message on transient errors.
+
+        Delivery callbacks sending several messages use this so a failure
+        part way through doesn't repeat what was already sent."""
+        for attempt in range(self.retries + 1):
+            try:
+                return await destination.send(*args, **kwargs)
+            except discord.HTTPException as e:
+                transient = e.status >= 500 or e.status == 429
+                if not transient or attempt == self.retries:
+                    raise
+                await asyncio.sleep(2**attempt)
+
+    async def deliver(self, doc, subdoc, payload, deliver, variants):
+        guild = doc["_obj"]
+        try:
+            await deliver(doc, payload, variants)
+            return "delivered"
+        except discord.Forbidden:
+            await self.cog.bot.database.set(guild, {f"{subdoc}.on": False},
+                                            self.cog)
+            return "disabled"
+        except discord.HTTPException as e:
+            log.warning(f"Broadcast to {guild.id} failed: {e}")
+            return "failed"
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.exception(f"Broadcast to {guild.id} failed", exc_info=e)
+            return "failed"
+
+    async def run(self,
+                  kind,
+                  broadcast_id,
+                  query,
+                  subdoc,
+                  payload,
+                  deliver,
+                  *,
+                  checkpoint=True):
+        """Call await deliver(doc, payload, variants) for every guild
+        subscribed through query, where doc is the guild's subdoc settings"""
+        done = set()
+        if checkpoint:
+            state = await self.collection.find_one({"_id": broadcast_id})
+            if state:
+                done = set(state.get("done", []))
+            else:
+                await self.collection.insert_one({
+                    "_id": broadcast_id,
+                    "kind": kind,
+                    "payload": payload,
+                    "done": [],
+                    "started": datetime.datetime.utcnow()
+                })
+        stats = collections.Counter()
+        delivered = []
+        semaphore = asyncio.Semaphore(self.concurrency)
+        variants = {}
+        tasks = set()
+
+        async def flush():
+            if not checkpoint or not delivered:
+                return
+            batch = delivered[:]
+            delivered.clear()
+            await self.collection.update_one(
+                {"_id": broadcast_id}, {"$addToSet": {
+                    "done": {
+                        "$each": batch
+                    }
+                }})
+
+        async def deliver_one(doc):
+            try:
+                result = await self.deliver(doc, subdoc, payload, deliver,
+                                            variants)
+                stats[result] += 1
+                delivered.append(doc["_obj"].id)
+                if len(delivered) >= self.flush_every:
+                    await flush()
+            finally:
+                semaphore.release()
+
+        start = datetime.datetime.utcnow()
+        cursor = self.cog.bot.database.iter("guilds",
+                                            query,
+                                            self.cog,
+                                            subdocs=[subdoc])
+        async for doc in cursor:
+            guild = doc["_obj"]
+            if not guild:
+                continue
+            if guild.id in done:
+                stats["resumed"] += 1
+                continue
+            await semaphore.acquire()
+            task = asyncio.create_task(deliver_one(doc))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+        for task in variants.values():
+            task.cancel()
+        variants.clear()
+        await flush()
+        if checkpoint:
+            await self.collection.delete_one({"_id": broadcast_id})
+        elapsed = (datetime.datetime.utcnow() - start).total_seconds()
+        log.info(f"Broadcast {broadcast_id} took {elapsed:.1f}s: "
+                 f"{dict(stats)}")
+        return stats
+
+    async def pending(self):
+        """Checkpoints of broadcasts that never finished"""
+        return await self.collection.find({}).to_list(None)
+
+    async def discard(self, broadcast_id):
+        await self.collection.delete_one({"_id": broadcast_id})
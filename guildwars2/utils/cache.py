@@ -0,0 +1,143 @@
+import asyncio
+import collections
+import copy
+import json
+import time
+
+
+class ResponseCache:
+    """In-process TTL cache that also coalesces concurrent identical
+    requests into a single upstream call."""
+
+    def __init__(self, max_entries=20000):
+        self.max_entries = max_entries
+        self._entries = {}
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if not entry:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        return value
+
+    def set(self, key, value, ttl):
+        if ttl <= 0:
+            return
+        if len(self._entries) >= self.max_entries:
+            self.purge()
+        self._entries[key] = (time.monotonic() + ttl, value)
+
+    def purge(self):
+        now = time.monotonic()
+        for key in [k for k, v in self._entries.items() if v[0] <= now]:
+            del self._entries[key]
+        # Still full - drop the oldest insertions
+        overflow = len(self._entries) - self.max_entries + 1
+        if overflow > 0:
+            for key in list(self._entries)[:overflow]:
+                del self._entries[key]
+
+    def invalidate(self, predicate=None):
+        if predicate is None:
+            self._entries.clear()
+            return
+        for key in [k for k in self._entries if predicate(k)]:
+            del self._entries[key]
+
+    async def fetch(self, key, ttl, factory):
+        """Return the cached value for key, or await factory() for it.
+
+        Callers asking for the same key while a fetch is in flight share
+        its result instead of starting their own."""
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        task = self._inflight.get(key)
+        if task:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+
+            def done(t):
+                self._inflight.pop(key, None)
+                if not t.cancelled() and t.exception() is None:
+                    self.set(key, t.result(), ttl)
+
+            task.add_done_callback(done)
+        # Shield so one cancelled caller doesn't cancel everyone else's fetch
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
+
+
+class LRUCache:
+    """Bounded least-recently-used cache for database documents.
+
+    Size is tracked as the length of each document's JSON encoding, which is
+    close enough to keep memory use in check without walking the objects.
+    Documents are deep copied on the way in and out since callers mutate
+    them."""
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return copy.deepcopy(entry[1])
+
+    def set(self, key, value):
+        size = len(json.dumps(value, default=str))
+        if size > self.max_bytes:
+            return
+        self.pop(key)
+        self._entries[key] = (size, copy.deepcopy(value))
+        self.size += size
+        while self.size > self.max_bytes:
+            _, (evicted, _) = self._entries.popitem(last=False)
+            self.size -= evicted
+
+    def pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[0]
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
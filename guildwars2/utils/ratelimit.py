@@ -0,0 +1,346 @@
+import asyncio
+import collections
+import contextlib
+import contextvars
+import heapq
+import itertools
+import time
+
+import discord
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+# Priority for outbound API calls made from the current task. Background
+# loops set this once at the start of an iteration; everything they spawn
+# inherits it.
+api_priority = contextvars.ContextVar("api_priority",
+                                      default=PRIORITY_INTERACTIVE)
+
+
+class TokenBucket:
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """Seconds until a token is available"""
+        self.refill()
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.refill()
+        self.tokens -= 1
+
+    def drain(self, seconds):
+        self.refill()
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+    @property
+    def idle(self):
+        self.refill()
+        return self.tokens >= self.capacity
+
+
+class ApiScheduler:
+    """Hands out permission to make outbound API requests.
+
+    Requests wait in a priority queue and are released in priority order
+    once both the global bucket and the bucket of the API key they use have
+    a token to spare. Lower priority numbers go first."""
+
+    def __init__(self,
+                 *,
+                 rate=5,
+                 capacity=150,
+                 key_rate=2,
+                 key_capacity=50,
+                 max_key_buckets=5000):
+        self.bucket = TokenBucket(rate, capacity)
+        self.key_rate = key_rate
+        self.key_capacity = key_capacity
+        self.max_key_buckets = max_key_buckets
+        self.key_buckets = {}
+        self.queue = []
+        self.counter = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.dispatcher = None
+        self.dispatched = 0
+
+    def get_key_bucket(self, key):
+        bucket = self.key_buckets.get(key)
+        if not bucket:
+            if len(self.key_buckets) >= self.max_key_buckets:
+                self.key_buckets = {
+                    k: b
+                    for k, b in self.key_buckets.items() if not b.idle
+                }
+            bucket = TokenBucket(self.key_rate, self.key_capacity)
+            self.key_buckets[key] = bucket
+        return bucket
+
+    async def acquire(self, key=None, priority=None):
+        if priority is None:
+            priority = api_priority.get()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.queue,
+                       (priority, next(self.counter), key, future))
+        if not self.dispatcher or self.dispatcher.done():
+            self.dispatcher = asyncio.create_task(self.dispatch())
+        self.wakeup.set()
+        await future
+
+    def penalize(self, seconds, key=None):
+        """Back off after the API told us we're going too fast"""
+        self.bucket.drain(seconds)
+        if key:
+            self.get_key_bucket(key).drain(seconds)
+
+    async def dispatch(self):
+        while True:
+            while self.queue and self.queue[0][3].done():
+                heapq.heappop(self.queue)
+            if not self.queue:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=60)
+                except asyncio.TimeoutError:
+                    if not self.queue:
+                        return
+                continue
+            delay = self.bucket.delay()
+            if delay:
+                await asyncio.sleep(delay)
+                continue
+            # Highest priority waiter whose key isn't exhausted
+            chosen = None
+            key_delay = None
+            for entry in sorted(self.queue):
+                _, _, key, future = entry
+                if future.done():
+                    continue
+                if key is None:
+                    chosen = entry
+                    break
+                wait = self.get_key_bucket(key).delay()
+                if not wait:
+                    chosen = entry
+                    break
+                if key_delay is None or wait < key_delay:
+                    key_delay = wait
+            if not chosen:
+                if key_delay is None:
+                    continue
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(),
+                                           timeout=key_delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self.queue.remove(chosen)
+            heapq.heapify(self.queue)
+            self.bucket.consume()
+            if chosen[2] is not None:
+                self.key_buckets[chosen[2]].consume()
+            self.dispatched += 1
+            chosen[3].set_result(None)
+
+    def stats(self):
+        depth = {}
+        for priority, _, _, future in self.queue:
+            if not future.done():
+                depth[priority] = depth.get(priority, 0) + 1
+        return {
+            "queued": sum(depth.values()),
+            "queued_by_priority": depth,
+            "dispatched": self.dispatched,
+            "global_tokens": round(self.bucket.tokens, 1),
+            "key_buckets": len(self.key_buckets),
+        }
+
+
+class DiscordWriteScheduler:
+    """Paces bulk Discord mutations (role edits, nicknames, kicks).
+
+    Every guild gets its own queue, drained by one worker at a time under a
+    shared global bucket plus a bucket per guild and route. A mutation
+    submitted while one with the same key is still queued is folded into it
+    instead of queued again. Routes can hold new mutations back for a
+    moment so that changes for the same key from different features have a
+    chance to be folded together."""
+
+    # Per guild (rate, capacity) of each route
+    ROUTES = {
+        "member": (1, 10),
+        "kick": (0.5, 5),
+    }
+    # Seconds a new mutation waits for others to merge with, per route
+    LINGER = {
+        "member": 1,
+    }
+
+    def __init__(self, *, rate=20, capacity=20, routes=None):
+        self.bucket = TokenBucket(rate, capacity)
+        self.routes = routes or self.ROUTES
+        self.route_buckets = {}
+        self.queues = {}
+        self.workers = {}
+        self.submitted = 0
+        self.coalesced = 0
+        self.executed = 0
+        self.rate_limited = 0
+
+    async def submit(self, guild_id, route, key, payload, execute, merge=None):
+        """Queue await execute(payload) and return its result.
+
+        If key is already queued, merge(old, new) builds the payload that
+        will run instead; without merge the newest payload wins."""
+        self.submitted += 1
+        queue = self.queues.setdefault(guild_id, collections.OrderedDict())
+        entry = queue.get(key)
+        if entry:
+            self.coalesced += 1
+            if merge:
+                payload = merge(entry["payload"], payload)
+            entry["payload"] = payload
+            entry["execute"] = execute
+        else:
+            entry = {
+                "route": route,
+                "payload": payload,
+                "execute": execute,
+                "future": asyncio.get_running_loop().create_future(),
+                "ready_at": time.monotonic() + self.LINGER.get(route, 0),
+            }
+            queue[key] = entry
+        worker = self.workers.get(guild_id)
+        if not worker or worker.done():
+            self.workers[guild_id] = asyncio.create_task(self.run(guild_id))
+        return await asyncio.shield(entry["future"])
+
+    def penalize(self, seconds):
+        self.rate_limited += 1
+        self.bucket.drain(seconds)
+
+    async def run(self, guild_id):
+        queue = self.queues[guild_id]
+        while queue:
+            key, entry = next(iter(queue.items()))
+            route = (guild_id, entry["route"])
+            bucket = self.route_buckets.get(route)
+            if not bucket:
+                bucket = TokenBucket(*self.routes[entry["route"]])
+                self.route_buckets[route] = bucket
+            delay = max(self.bucket.delay(), bucket.delay(),
+                        entry["ready_at"] - time.monotonic())
+            if delay:
+                await asyncio.sleep(delay)
+                continue
+            del queue[key]
+            self.bucket.consume()
+            bucket.consume()
+            future = entry["future"]
+            try:
+                result = await entry["execute"](entry["payload"])
+            except discord.RateLimited as e:
+                self.penalize(e.retry_after)
+                self.retry(queue, key, entry, e)
+            except discord.HTTPException as e:
+                if e.status != 429:
+                    if not future.done():
+                        future.set_exception(e)
+                    continue
+                self.penalize(5)
+                self.retry(queue, key, entry, e)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                self.executed += 1
+                if not future.done():
+                    future.set_result(result)
+        del self.queues[guild_id]
+        self.route_buckets = {
+            k: v
+            for k, v in self.route_buckets.items() if not v.idle
+        }
+
+    @staticmethod
+    def retry(queue, key, entry, exception):
+        if key in queue:
+            # Superseded while we were waiting on Discord
+            if not entry["future"].done():
+                entry["future"].set_exception(exception)
+            return
+        queue[key] = entry
+        queue.move_to_end(key, last=False)
+
+    def stats(self):
+        return {
+            "queued": sum(len(q) for q in self.queues.values()),
+            "guilds": len(self.queues),
+            "submitted": self.submitted,
+            "coalesced": self.coalesced,
+            "executed": self.executed,
+            "rate_limited": self.rate_limited,
+        }
+
+
+class TransferBudget:
+    """Caps how many transfers run at once and how many bytes they move
+    between them. A transfer bigger than the whole budget still gets to run
+    once nothing else is in flight."""
+
+    def __init__(self, max_transfers, max_bytes):
+        self.max_transfers = max_transfers
+        self.max_bytes = max_bytes
+        self.transfers = 0
+        self.bytes = 0
+        self.waiting = 0
+        self.completed = 0
+        self.condition = asyncio.Condition()
+
+    def fits(self, size):
+        if not self.transfers:
+            return True
+        return (self.transfers < self.max_transfers
+                and self.bytes + size <= self.max_bytes)
+
+    @contextlib.asynccontextmanager
+    async def acquire(self, size):
+        async with self.condition:
+            self.waiting += 1
+            try:
+                await self.condition.wait_for(lambda: self.fits(size))
+            finally:
+                self.waiting -= 1
+            self.transfers += 1
+            self.bytes += size
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.transfers -= 1
+                self.bytes -= size
+                self.completed += 1
+                self.condition.notify_all()
+
+    def stats(self):
+        return {
+            "in_flight": self.transfers,
+            "bytes_in_flight": self.bytes,
+            "waiting": self.waiting,
+            "completed": self.completed,
+        }
@@ -0,0 +1,71 @@
+import array
+import collections
+import heapq
+
+# Collections with an in-memory name index, and the extra fields autocomplete
+# handlers need from each entry
+SEARCH_FIELDS = {
+    "items": ["rarity", "type", "flags"],
+    "skins": [],
+    "achievements": [],
+    "skills": ["professions"],
+    "traits": [],
+    "currencies": [],
+    "worlds": [],
+}
+
+
+class SearchIndex:
+    """Case-insensitive substring search over document names.
+
+    Names are broken into trigrams so a query only has to check the entries
+    sharing its rarest trigram. Results are ranked exact match first, then
+    prefix, then word prefix, then any other substring, shorter names
+    first."""
+
+    def __init__(self, docs):
+        self.docs = [doc for doc in docs if doc.get("name")]
+        self.names = [doc["name"].lower() for doc in self.docs]
+        grams = collections.defaultdict(list)
+        for i, name in enumerate(self.names):
+            for gram in {name[j:j + 3] for j in range(len(name) - 2)}:
+                grams[gram].append(i)
+        self.grams = {k: array.array("I", v) for k, v in grams.items()}
+
+    def __len__(self):
+        return len(self.docs)
+
+    def candidates(self, query):
+        if len(query) < 3:
+            return range(len(self.names))
+        postings = []
+        for j in range(len(query) - 2):
+            posting = self.grams.get(query[j:j + 3])
+            if posting is None:
+                return []
+            postings.append(posting)
+        return min(postings, key=len)
+
+    @staticmethod
+    def rank(query, name):
+        if name == query:
+            return 0
+        if name.startswith(query):
+            return 1
+        if " " + query in name:
+            return 2
+        return 3
+
+    def search(self, query, limit=25, predicate=None):
+        query = query.lower().strip()
+        if not query:
+            return []
+        matches = []
+        for i in self.candidates(query):
+            name = self.names[i]
+            if query not in name:
+                continue
+            if predicate and not predicate(self.docs[i]):
+                continue
+            matches.append((self.rank(query, name), len(name), name, i))
+        return [self.docs[m[3]] for m in heapq.nsmallest(limit, matches)]
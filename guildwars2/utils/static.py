@@ -0,0 +1,88 @@
+import asyncio
+import copy
+
+# Collections that only change on a game build and are small enough to keep
+# in memory in full
+STATIC_COLLECTIONS = [
+    "skills", "traits", "specializations", "professions", "legends", "pets",
+    "itemstats", "colors", "currencies", "titles", "worlds"
+]
+
+
+class StaticDataStore:
+    """Read-through in-memory copy of static game data collections.
+
+    Lookups hand out deep copies, so callers can modify the documents they
+    get back the same way they could with a fresh find_one."""
+
+    def __init__(self, db, collections=STATIC_COLLECTIONS):
+        self.db = db
+        self.collections = list(collections)
+        self.data = {}
+        self.indexes = {}
+        self.lock = asyncio.Lock()
+
+    async def load(self, collections=None):
+        async with self.lock:
+            for name in collections or self.collections:
+                docs = {}
+                async for doc in self.db[name].find({}):
+                    docs[doc["_id"]] = doc
+                self.data[name] = docs
+                self.indexes = {
+                    k: v
+                    for k, v in self.indexes.items() if k[0] != name
+                }
+
+    def loaded(self, collection):
+        return collection in self.data
+
+    def get(self, collection, _id):
+        doc = self.data.get(collection, {}).get(_id)
+        return copy.deepcopy(doc) if doc is not None else None
+
+    def get_by(self, collection, field, value):
+        index = self.indexes.get((collection, field))
+        if index is None:
+            index = {}
+            for doc in self.data.get(collection, {}).values():
+                index.setdefault(doc.get(field), doc)
+            self.indexes[(collection, field)] = index
+        doc = index.get(value)
+        return copy.deepcopy(doc) if doc is not None else None
+
+    async def fetch(self, collection, _id):
+        if self.loaded(collection):
+            doc = self.get(collection, _id)
+            if doc is not None:
+                return doc
+        doc = await self.db[collection].find_one({"_id": _id})
+        if doc is not None and self.loaded(collection):
+            self.data[collection][_id] = copy.deepcopy(doc)
+        return doc
+
+    async def fetch_by(self, collection, field, value):
+        if self.loaded(collection):
+            doc = self.get_by(collection, field, value)
+            if doc is not None:
+                return doc
+        return await self.db[collection].find_one({field: value})
+
+    async def fetch_many(self, collection, ids):
+        """Return {id: doc} for every id that exists, querying the database
+        once for whatever isn't in memory"""
+        found = {}
+        missing = []
+        for _id in ids:
+            doc = self.get(collection, _id) if self.loaded(collection) else None
+            if doc is None:
+                missing.append(_id)
+            else:
+                found[_id] = doc
+        if missing:
+            cursor = self.db[collection].find({"_id": {"$in": missing}})
+            async for doc in cursor:
+                found[doc["_id"]] = doc
+                if self.loaded(collection):
+                    self.data[collection][doc["_id"]] = copy.deepcopy(doc)
+        return found
@@ -0,0 +1,61 @@
+import bisect
+import datetime
+
+UTC_TZ = datetime.timezone.utc
+
+
+class Timeline:
+    """Events repeating every cycle seconds, at fixed offsets into the
+    cycle. Cycles are counted from the epoch, so any cycle that divides a
+    day starts at midnight UTC."""
+
+    def __init__(self, cycle, events):
+        entries = sorted(events, key=lambda e: e[0])
+        self.cycle = cycle
+        self.offsets = [offset % cycle for offset, _ in entries]
+        self.events = [event for _, event in entries]
+
+    def __len__(self):
+        return len(self.events)
+
+    def _locate(self, at):
+        timestamp = at.timestamp()
+        start = timestamp - timestamp % self.cycle
+        return start, timestamp - start
+
+    def _time(self, start, i):
+        return datetime.datetime.fromtimestamp(start + self.offsets[i],
+                                               UTC_TZ)
+
+    def occurrences(self, after, limit=None):
+        """Yield (time, event) for each occurrence strictly after after"""
+        if not self.events:
+            return
+        start, position = self._locate(after)
+        i = bisect.bisect_right(self.offsets, position)
+        count = 0
+        while limit is None or count < limit:
+            if i == len(self.offsets):
+                i = 0
+                start += self.cycle
+            yield self._time(start, i), self.events[i]
+            i += 1
+            count += 1
+
+    def next(self, after, predicate=None):
+        """First occurrence after after matching predicate, or None"""
+        for when, event in self.occurrences(after, len(self.events)):
+            if predicate is None or predicate(event):
+                return when, event
+        return None
+
+    def current(self, at):
+        """Latest occurrence at or before at, or None"""
+        if not self.events:
+            return None
+        start, position = self._locate(at)
+        i = bisect.bisect_right(self.offsets, position) - 1
+        if i < 0:
+            i = len(self.offsets) - 1
+            start -= self.cycle
+        return self._time(start, i), self.events[i]
@@ -0,0 +1,69 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+
+class TimerHeap:
+    """Min-heap of keys ordered by the wall clock time they are due at.
+
+    Rescheduling or cancelling a key leaves its old entry behind, to be
+    skipped when it reaches the top."""
+
+    def __init__(self):
+        self.heap = []
+        self.due = {}
+        self.counter = itertools.count()
+        self.changed = asyncio.Event()
+
+    def __len__(self):
+        return len(self.due)
+
+    def schedule(self, key, when):
+        self.due[key] = when
+        heapq.heappush(self.heap, (when, next(self.counter), key))
+        if len(self.heap) > 2 * len(self.due) + 64:
+            self.compact()
+        self.changed.set()
+
+    def cancel(self, key):
+        self.due.pop(key, None)
+
+    def compact(self):
+        self.heap = [(when, next(self.counter), key)
+                     for key, when in self.due.items()]
+        heapq.heapify(self.heap)
+
+    def next_due(self):
+        while self.heap:
+            when, _, key = self.heap[0]
+            if self.due.get(key) == when:
+                return when
+            heapq.heappop(self.heap)
+        return None
+
+    def pop_due(self, now=None):
+        """Remove and return every key due by now"""
+        now = time.time() if now is None else now
+        keys = []
+        while self.heap and self.heap[0][0] <= now:
+            when, _, key = heapq.heappop(self.heap)
+            if self.due.get(key) == when:
+                del self.due[key]
+                keys.append(key)
+        return keys
+
+    async def wait(self):
+        """Sleep until at least one key is due, then pop the due keys"""
+        while True:
+            self.changed.clear()
+            now = time.time()
+            keys = self.pop_due(now)
+            if keys:
+                return keys
+            when = self.next_due()
+            timeout = None if when is None else when - now
+            try:
+                await asyncio.wait_for(self.changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
@@ -7,7 +7,6 @@ from discord.app_commands import Choice
 
 from .exceptions import APIError
 from .utils.chat import embed_list_lines
-from .utils.db import prepare_search
 
 
 class WalletMixin:
@@ -20,8 +19,9 @@ class WalletMixin:
         found_ids = []
         for c in results:
             found_ids.append(c["id"])
+        currencies = await self.static.fetch_many("currencies", flattened_ids)
         for id in flattened_ids:
-            c_doc = await self.db.currencies.find_one({"_id": id})
+            c_doc = currencies[id]
             emoji = self.get_emoji(interaction, c_doc["name"])
             for i in range(0, len(lines)):
                 if id in ids[i]:
@@ -50,11 +50,12 @@ class WalletMixin:
                                                           flattened_ids,
                                                           doc=doc)
 
+        itemdocs = await self.fetch_items(search_results)
         for i in range(0, len(ids)):
             lines.append([])
             for k, v in search_results.items():
                 if k in ids[i]:
-                    doc = await self.db.items.find_one({"_id": k})
+                    doc = itemdocs[k]
                     name = doc["name"]
                     name = re.sub(r'^\d+ ', '', name)
                     emoji = self.get_emoji(interaction, name)
@@ -69,9 +70,7 @@ class WalletMixin:
             return []
         if current == "gold":
             return [Choice(name="Gold", value="1")]
-        query = prepare_search(current)
-        query = {"name": query}
-        items = await self.db.currencies.find(query).to_list(25)
+        items = await self.search_collection("currencies", current)
         return [Choice(name=it["name"], value=str(it["_id"])) for it in items]
 
     @app_commands.command()
@@ -97,7 +96,7 @@ class WalletMixin:
         doc = await self.fetch_key(interaction.user, ["wallet"])
         if currency is not None:
             results = await self.call_api("account/wallet", key=doc["key"])
-            choice = await self.db.currencies.find_one({"_id": currency})
+            choice = await self.static.fetch("currencies", currency)
             embed = discord.Embed(title=choice["name"].title(),
                                   description=choice["description"],
                                   colour=await
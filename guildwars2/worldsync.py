@@ -4,11 +4,17 @@ import discord
 from discord.ext import commands, tasks
 from discord import app_commands
 
-from cogs.guildwars2.utils.db import prepare_search
 from .exceptions import APIBadRequest, APIError, APIInvalidKey
 import time
 from discord.app_commands import Choice
 
+# Seconds an account's home world is trusted before asking the API again
+HOME_WORLD_TTL = 1800
+# Seconds between full worldsync passes while the links stay the same.
+# Catches world transfers, and is longer than HOME_WORLD_TTL so every pass
+# sees fresh home worlds.
+WORLDSYNC_TRICKLE_INTERVAL = 3600
+
 
 class WorldsyncMixin:
 
@@ -17,9 +23,7 @@ class WorldsyncMixin:
                                            current: str):
         if not current:
             return []
-        query = prepare_search(current)
-        query = {"name": query}
-        items = await self.db.worlds.find(query).to_list(25)
+        items = await self.search_collection("worlds", current)
         return [Choice(name=it["name"], value=str(it["_id"])) for it in items]
 
     @app_commands.command()
@@ -85,21 +89,62 @@ class WorldsyncMixin:
             return
         await self.sync_worlds(worldsync, ctx.guild)
 
-    async def get_linked_worlds(self, world):
+    async def get_linked_worlds(self, world, matchups=None):
+        """Worlds linked with world. Pass the same matchups dict to share
+        results between calls."""
+        if matchups is not None and world in matchups:
+            return matchups[world]
         endpoint = f"wvw/matches/overview?world={world}"
         results = await self.call_api(endpoint)
+        linked = []
         for worlds in results["all_worlds"].values():
             if world in worlds:
                 worlds.remove(world)
-                return worlds
-        return []
+                linked = worlds
+                break
+        if matchups is not None:
+            matchups[world] = linked
+        return linked
+
+    async def get_matchups(self):
+        """Return ({world: linked worlds}, topology) for every current match.
+
+        topology changes whenever worlds are relinked or matches reset."""
+        results = await self.call_api("wvw/matches/overview?ids=all")
+        matchups = {}
+        topology = []
+        for match in results:
+            sides = match["all_worlds"].values()
+            for worlds in sides:
+                for world in worlds:
+                    matchups[world] = [w for w in worlds if w != world]
+            topology.append((match["id"], match["start_time"],
+                             tuple(sorted(tuple(sorted(w)) for w in sides))))
+        return matchups, tuple(sorted(topology))
+
+    async def get_home_world(self, key_doc):
+        """World of the account behind key_doc, cached per account"""
 
-    async def worldsync_member(self, member, world_role, ally_role, world_id,
-                               linked_worlds):
+        async def fetch():
+            results = await self.call_api("account", key=key_doc["key"])
+            return results["world"]
+
+        return await self.home_world_cache.fetch(key_doc["account_name"],
+                                                 HOME_WORLD_TTL, fetch)
+
+    async def worldsync_member(self,
+                               member,
+                               world_role,
+                               ally_role,
+                               world_id,
+                               linked_worlds,
+                               *,
+                               doc=None):
         on_world = False
         on_linked = False
         try:
-            doc = await self.bot.database.get(member, self)
+            if doc is None:
+                doc = await self.bot.database.get(member, self)
             keys = doc.get("keys", [])
             key = doc.get("key", {})
             if (key and not keys) or key not in keys:
@@ -111,10 +156,7 @@ class WorldsyncMixin:
                 if key_doc["account_name"] in checked_accounts:
                     continue
                 try:
-                    await asyncio.sleep(0.3)
-                    results = await self.call_api("account",
-                                                  key=key_doc["key"])
-                    user_world = results["world"]
+                    user_world = await self.get_home_world(key_doc)
                     if user_world == world_id:
                         on_world = True
                     if user_world in linked_worlds:
@@ -127,35 +169,45 @@ class WorldsyncMixin:
         single_role = world_role == ally_role
         has_world_role = world_role and world_role in member.roles
         has_ally_role = ally_role and ally_role in member.roles
+        to_add = []
+        to_remove = []
         if world_role:
             if on_world and not has_world_role:
-                await member.add_roles(world_role)
+                to_add.append(world_role)
             elif not on_world and has_world_role:
                 if not (single_role and on_linked):
-                    await member.remove_roles(world_role)
+                    to_remove.append(world_role)
         if ally_role:
             if on_linked and not has_ally_role:
-                await member.add_roles(ally_role)
+                to_add.append(ally_role)
             elif not on_linked and has_ally_role:
                 if not (single_role and has_world_role):
-                    await member.remove_roles(ally_role)
+                    to_remove.append(ally_role)
+        await self.edit_member_roles(member,
+                                     add=to_add,
+                                     remove=to_remove,
+                                     reason="Worldsync")
 
-    async def sync_worlds(self, doc, guild):
+    async def sync_worlds(self, doc, guild, *, matchups=None):
         world_id = doc.get("world_id")
         try:
-            linked_worlds = await self.get_linked_worlds(world_id)
+            linked_worlds = await self.get_linked_worlds(world_id, matchups)
         except APIError:
             return
         world_role = guild.get_role(doc.get("world_role"))
         ally_role = guild.get_role(doc.get("ally_role"))
         if not world_role and not ally_role:
             return
-        for member in guild.members:
+        members = [member for member in guild.members if not member.bot]
+        docs = await self.get_many(members)
+        for member in members:
             try:
-                if member.bot:
-                    continue
-                await self.worldsync_member(member, world_role, ally_role,
-                                            world_id, linked_worlds)
+                await self.worldsync_member(member,
+                                            world_role,
+                                            ally_role,
+                                            world_id,
+                                            linked_worlds,
+                                            doc=docs[member.id])
             except discord.HTTPException:
                 pass
 
@@ -183,19 +235,33 @@ class WorldsyncMixin:
 
     @tasks.loop(minutes=5)
     async def worldsync_task(self):
+        self.background_api_calls()
+        start = time.time()
+        try:
+            matchups, topology = await self.get_matchups()
+        except APIError:
+            # Fall back to resolving links per world
+            matchups, topology = {}, None
+        relinked = topology != self.worldsync_topology
+        trickle = start - self.worldsync_last_full >= WORLDSYNC_TRICKLE_INTERVAL
+        if topology is not None and not relinked and not trickle:
+            return
         cursor = self.bot.database.iter("guilds", {"worldsync.enabled": True},
                                         self,
                                         subdocs=["worldsync"])
-        start = time.time()
         async for doc in cursor:
             try:
-                await self.sync_worlds(doc, doc["_obj"])
+                await self.sync_worlds(doc, doc["_obj"], matchups=matchups)
             except asyncio.CancelledError:
                 return
             except Exception:
                 pass
         end = time.time()
-        self.log.info(f"Worldsync took {end - start} seconds")
+        if topology is not None:
+            self.worldsync_topology = topology
+            self.worldsync_last_full = start
+        reason = "relink" if relinked else "trickle refresh"
+        self.log.info(f"Worldsync ({reason}) took {end - start} seconds")
 
     @worldsync_task.before_loop
     async def before_worldsync_task(self):
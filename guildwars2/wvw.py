@@ -3,7 +3,6 @@ import io
 from discord import app_commands
 from discord.app_commands import Choice
 
-from cogs.guildwars2.utils.db import prepare_search
 try:
     import matplotlib
     matplotlib.use("agg")
@@ -69,9 +68,7 @@ class WvwMixin:
         if not current:
             return []
         current = current.lower()
-        query = prepare_search(current)
-        query = {"name": query}
-        items = await self.db.worlds.find(query).to_list(25)
+        items = await self.search_collection("worlds", current)
         return [Choice(name=it["name"], value=str(it["_id"])) for it in items]
 
     @wvw_group.command(name="info")